@@ -0,0 +1,23 @@
+from baselines.common.vec_env import VecEnvWrapper
+
+
+class ActionMapVecEnv(VecEnvWrapper):
+    def __init__(self, venv, mapping):
+        """
+        venv: VecEnv of AIBirdEnvs built with process_action=np.asarray
+        mapping: vectorized action mapping, e.g. aibird_actions.QuantizedActions
+
+        Maps the actions of every env at once before stepping them. The
+        action space seen by the agent stays the one of venv.
+        """
+        VecEnvWrapper.__init__(self, venv)
+        self.mapping = mapping
+
+    def step_async(self, actions):
+        self.venv.step_async(self.mapping(actions))
+
+    def step_wait(self):
+        return self.venv.step_wait()
+
+    def reset(self):
+        return self.venv.reset()
@@ -0,0 +1,60 @@
+"""Vectorized mapping from policy actions to AIBird shots
+
+Every mapping takes one action or a batch of them, one per env, and returns
+the (angle, tap time) of the shots as float64 rows, without Python loops.
+
+Example:
+    quantize = QuantizedActions([90, 2.5], [-10, 0.1])     # 60 discrete shots
+    angle, tap = quantize(7)
+    shots = quantize(np.array([7, 59]))                     # (2, 2) array
+"""
+import numpy as np
+
+
+def logistic(x):
+    """Logistic function 1 / (1 + exp(-x)), computed through tanh so that
+    large |x| does not overflow.
+    """
+    return 0.5 + 0.5 * np.tanh(0.5 * np.asarray(x, dtype=np.float64))
+
+
+class Squash:
+    """Maps (-infty, infty) to [low, high] via the logistic function.
+
+    Args
+        low, high -- bounds of every action dimension
+    """
+    def __init__(self, low, high):
+        self.low = np.asarray(low, dtype=np.float64)
+        self.scale = np.asarray(high, dtype=np.float64) - self.low
+
+    def __call__(self, actions):
+        return logistic(actions) * self.scale + self.low
+
+
+class QuantizedActions:
+    """Lookup table of the nangle * ntap discrete shots.
+
+    Action `a` shoots at the angle interpolated at (a % nangle + angle_offset) / nangle
+    and the tap time interpolated at (a // nangle + 1) / ntap between
+    min_action and max_action.
+
+    Args
+        max_action, min_action -- [angle, tap time] bounds
+        angle_offset -- 1 skips the angle min_action[0]
+    """
+    def __init__(self, max_action, min_action, nangle=12, ntap=5, angle_offset=0):
+        acts = np.arange(nangle * ntap)
+        tangle = (acts % nangle + angle_offset) / nangle
+        ttap = (acts // nangle + 1) / ntap
+        self.table = np.stack([tangle * max_action[0] + (1 - tangle) * min_action[0],
+                               ttap * max_action[1] + (1 - ttap) * min_action[1]], axis=-1)
+        self.table.setflags(write=False)
+
+    @property
+    def n(self):
+        """Number of discrete actions"""
+        return len(self.table)
+
+    def __call__(self, actions):
+        return self.table[actions]
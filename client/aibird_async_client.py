@@ -0,0 +1,273 @@
+"""asyncio version of the AIBird Client module"""
+import asyncio
+import base64
+import io
+from socket import timeout
+
+import numpy as np
+from PIL import Image
+
+import aibird_message
+from aibird_client import DELTA_TILE, MAXTRIALS, TIMEOUT, DeltaFrame
+
+
+class AsyncAIBirdClient:
+    """Handles communication with the AIBird Server over asyncio streams
+
+    Mirrors AIBirdClient, except that every request is a coroutine. Requests
+    made concurrently on one client are serialized. A request that takes
+    longer than TIMEOUT raises socket.timeout, like the blocking client.
+
+    Attributes
+        host (str): address of AIBird Server. Default is `localhost`
+        port (int): port of AIBird Server. Default is `2004`
+        delta_tile, roi, scale, grayscale: see AIBirdClient
+
+    Usage:
+        client = AsyncAIBirdClient()
+        await client.connect()
+        img = await client.screenshot()
+        shoot = process_screenshot(img)     # A user defined function
+        await client.polar_shoot(*shoot)
+    """
+    def __init__(self, host='localhost', port=2004, delta_tile=0,
+                 roi=None, scale=1, grayscale=False):
+        self.host = host
+        self.port = port
+        self.delta_tile = delta_tile
+        self.roi = roi
+        self.scale = scale
+        self.grayscale = grayscale
+        self._reader = None
+        self._delta = DeltaFrame()
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._scores = [0] * 21
+        self._current_level = 1
+
+    async def connect(self):
+        """Connect to AIBird server."""
+        self._reader, self._writer = await self._wait(
+            asyncio.open_connection(self.host, self.port))
+        self._delta = DeltaFrame()
+        if self.roi is not None or self.scale != 1 or self.grayscale:
+            if not await self.configure_screenshot(self.roi, self.scale, self.grayscale):
+                raise ValueError('AIBird server rejected roi {}, scale {}'.format(
+                    self.roi, self.scale))
+        await self.load_level(self._current_level)
+
+    async def disconnect(self):
+        """Disconnect from AIBird server."""
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    @property
+    def current_level(self):
+        """ Return current level """
+        return self._current_level
+
+    @property
+    def total_score(self):
+        """ Sum of the scores for each level(there are 21 of them) """
+        return sum(self._scores)
+
+    async def _wait(self, coro):
+        try:
+            return await asyncio.wait_for(coro, TIMEOUT)
+        except asyncio.TimeoutError:
+            raise timeout('AIBird server did not respond in {} s'.format(TIMEOUT))
+
+    async def _request(self, msg, receive):
+        """Send `msg` and return the result of awaiting `receive()`."""
+        async with self._lock:
+            self._writer.write(msg)
+            return await self._wait(self._drain_and_receive(receive))
+
+    async def _drain_and_receive(self, receive):
+        await self._writer.drain()
+        return await receive()
+
+    async def _recv_result(self):
+        return aibird_message.recv_result(
+            await self._reader.readexactly(aibird_message.LEN_ETC))
+
+    async def _recv_score(self):
+        return aibird_message.recv_score(
+            await self._reader.readexactly(aibird_message.LEN_GET_SCORE))
+
+    async def _recv_state(self):
+        return aibird_message.recv_state(
+            await self._reader.readexactly(aibird_message.LEN_GET_STATE))
+
+    async def _recv_screenshot(self):
+        size = aibird_message.recv_screenshot_size(
+            await self._reader.readexactly(aibird_message.LEN_SCREENSHOT))
+        data = await self._reader.readexactly(size)
+        return np.array(Image.open(io.BytesIO(base64.b64decode(data))))
+
+    async def _recv_raw_screenshot(self):
+        width, height, channels, dtype = aibird_message.recv_raw_screenshot_header(
+            await self._reader.readexactly(aibird_message.LEN_RAW_SCREENSHOT_HEADER))
+        dtype = np.dtype(dtype)
+        data = await self._reader.readexactly(width * height * channels * dtype.itemsize)
+        return np.frombuffer(data, dtype).reshape(height, width, channels)
+
+    async def _recv_delta_screenshot(self):
+        width, height, channels, dtype, tile, count = \
+            aibird_message.recv_delta_screenshot_header(
+                await self._reader.readexactly(aibird_message.LEN_DELTA_SCREENSHOT_HEADER))
+        dtype = np.dtype(dtype)
+        indices = await self._reader.readexactly(4 * count)
+        tiles = await self._reader.readexactly(count * tile * tile * channels * dtype.itemsize)
+        return self._delta.patch(width, height, channels, dtype, tile, indices, tiles)
+
+    async def _recv_vision(self):
+        count = aibird_message.recv_vision_count(
+            await self._reader.readexactly(aibird_message.LEN_VISION_COUNT))
+        return aibird_message.recv_vision_objects(
+            await self._reader.readexactly(count * aibird_message.LEN_VISION_OBJECT))
+
+    async def _recv_step_vision(self):
+        reward, state, birds = aibird_message.recv_step(
+            await self._reader.readexactly(aibird_message.LEN_STEP))
+        return reward, state, birds, await self._recv_vision()
+
+    async def _recv_step(self):
+        reward, state, birds = aibird_message.recv_step(
+            await self._reader.readexactly(aibird_message.LEN_STEP))
+        if self.delta_tile:
+            return reward, state, birds, await self._recv_delta_screenshot()
+        return reward, state, birds, await self._recv_raw_screenshot()
+
+    async def current_score(self):
+        """ Score of the current level """
+        score = await self._request(aibird_message.get_my_score(), self._recv_score)
+        self._scores[self._current_level - 1] = score
+        return score
+
+    async def screenshot(self):
+        """ A numpy array containing the screenshot"""
+        return await self._request(aibird_message.get_screenshot(), self._recv_screenshot)
+
+    async def raw_screenshot(self):
+        """ A read-only numpy array containing the screenshot, sent without any encoding."""
+        return await self._request(aibird_message.get_raw_screenshot(),
+                                   self._recv_raw_screenshot)
+
+    async def delta_screenshot(self):
+        """ The screenshot patched with the tiles that changed since the last
+        delta screenshot. See AIBirdClient.delta_screenshot.
+        """
+        return await self._request(
+            aibird_message.get_delta_screenshot(self.delta_tile or DELTA_TILE),
+            self._recv_delta_screenshot)
+
+    async def vision(self):
+        """ Objects the server detects in the current screenshot, see
+        aibird_message.recv_vision_objects.
+        """
+        return await self._request(aibird_message.get_vision(), self._recv_vision)
+
+    async def configure_screenshot(self, roi=None, scale=1, grayscale=False):
+        """Register with the server how to reduce raw, delta and step screenshots.
+        See AIBirdClient.configure_screenshot.
+        """
+        color = aibird_message.COLOR_GRAY if grayscale else aibird_message.COLOR_RGB
+        result = await self._request(
+            aibird_message.configure_screenshot(*(roi or (0, 0, 0, 0)), scale, color),
+            self._recv_result)
+        if result:
+            self.roi, self.scale, self.grayscale = roi, scale, grayscale
+        return result
+
+    async def state(self):
+        """Get current state
+
+        Return a GameState object.
+        """
+        return await self._request(aibird_message.get_state(), self._recv_state)
+
+    async def _zoom_out_fully(self):
+        for _ in range(MAXTRIALS):
+            if await self.zoom_out():
+                break
+        else:
+            raise Exception('cart_shoot: reached MAXTRIALS')
+
+    async def _shoot(self, msg):
+        if await self._request(msg, self._recv_result):
+            initial_score = self._scores[self._current_level - 1]
+            return await self.current_score() - initial_score
+        return -1
+
+    async def cart_shoot(self, dx, dy, tap_time, mode='safe'):
+        """Send cart_shoot request. See AIBirdClient.cart_shoot."""
+        await self._zoom_out_fully()
+        return await self._shoot(aibird_message.cart_shoot(dx, dy, tap_time, mode))
+
+    async def polar_shoot(self, theta, tap_time, mode='safe'):
+        """Send polar_shoot request. See AIBirdClient.polar_shoot."""
+        await self._zoom_out_fully()
+        return await self._shoot(aibird_message.polar_shoot(50, theta, tap_time, mode))
+
+    async def shoot_and_observe(self, theta, tap_time):
+        """Zoom out, shoot and observe the outcome with a single request.
+        See AIBirdClient.shoot_and_observe.
+        """
+        if self.delta_tile:
+            msg = aibird_message.polar_step_delta(50, theta, tap_time, self.delta_tile)
+        else:
+            msg = aibird_message.polar_step(50, theta, tap_time)
+        reward, state, birds, frame = await self._request(msg, self._recv_step)
+        self._scores[self._current_level - 1] += reward
+        return reward, state, birds, frame
+
+    async def shoot_and_detect(self, theta, tap_time):
+        """Like shoot_and_observe, but return the detected objects instead of a
+        screenshot. See AIBirdClient.shoot_and_detect.
+        """
+        reward, state, birds, objects = await self._request(
+            aibird_message.polar_step_vision(50, theta, tap_time), self._recv_step_vision)
+        self._scores[self._current_level - 1] += reward
+        return reward, state, birds, objects
+
+    async def zoom_in(self):
+        """Send zoom in request.
+        Return True if succeeded, False otherwise.
+        """
+        return await self._request(aibird_message.zoom_in(), self._recv_result)
+
+    async def zoom_out(self):
+        """Send zoom out request.
+        Return True if succeeded, False otherwise.
+        """
+        return await self._request(aibird_message.zoom_out(), self._recv_result)
+
+    async def next_level(self):
+        """ Load next level.
+        Return False if current level is 21, True otherwie.
+        """
+        if self._current_level < 21:
+            if not await self.load_level(self._current_level + 1):
+                print("Failed to load level {}".format(self._current_level + 1))
+            return True
+        return False
+
+    async def load_level(self, level):
+        """Send load level `level` request.
+        Return True if succeeded, False otherwise.
+        """
+        result = await self._request(aibird_message.load_level(level), self._recv_result)
+        if result:
+            self._current_level = level
+            self._scores[level - 1] = 0
+        return result
+
+    async def restart_level(self):
+        """Send restart level request.
+        Return True if succeeded, False otherwise.
+        """
+        result = await self._request(aibird_message.restart_level(), self._recv_result)
+        if result:
+            self._scores[self._current_level - 1] = 0
+        return result
@@ -0,0 +1,99 @@
+""" asyncio version of the OpenAI environment interface for AIBird client """
+import asyncio
+
+import gym
+
+import aibird_async_client
+from aibird_env import AIBirdEnv, prepare_env, safe_terminate
+
+class AsyncAIBirdEnv(AIBirdEnv):
+    """AIBirdEnv driven by an AsyncAIBirdClient
+
+    Takes the same arguments as AIBirdEnv. `startup`, `step`, `reset`,
+    `terminate` and `restart` are coroutines, so that one event loop can drive
+    many instances. Launching and killing chrome and the server blocks, so it
+    runs in the default executor.
+    """
+
+    async def startup(self, server_path, chrome_user, client_port):
+        """Setups the AIBird client. Must be awaited before anything else.
+        """
+        loop = asyncio.get_event_loop()
+        self.chrome, self.server = await loop.run_in_executor(
+            None, prepare_env, server_path, chrome_user, client_port)
+        self.server_path = server_path
+        self.chrome_user = chrome_user
+        self.client_port = client_port
+        self.aibird_client = aibird_async_client.AsyncAIBirdClient(
+            port=client_port, delta_tile=self.delta_tile, **self.screenshot_config)
+        await self.aibird_client.connect()
+        if self.observation == 'vision':
+            self.observation_space = self._features.observation_space
+            return
+        screenshot = await self._get_state()
+        self.observation_space = gym.spaces.Box(
+            low=0, high=255, shape=screenshot.shape, dtype=screenshot.dtype)
+
+    async def _get_state(self):
+        """ Get screenshot from AIBird Client and process it. """
+        if self.observation == 'vision':
+            return self._features(await self.aibird_client.vision())
+        if self.delta_tile:
+            return self._process_state(await self.aibird_client.delta_screenshot())
+        return self._process_state(await self.aibird_client.raw_screenshot())
+
+    async def step(self, action):
+        """Executes `action` and returns the reward. """
+        processed_action = self._process_action(action)
+        if self.observation == 'vision':
+            reward, state, birds, objects = await self.aibird_client.shoot_and_detect(
+                *processed_action)
+            observation = self._features(objects)
+        else:
+            reward, state, birds, frame = await self.aibird_client.shoot_and_observe(
+                *processed_action)
+            observation = self._process_state(frame)
+        info = {'birds': birds, 'state': state.state}
+        if state.isover():
+            if state.won():
+                if await self.aibird_client.next_level():
+                    # Proceed to next level
+                    observation = await self._get_state()
+                    return observation, reward, False, info
+            # Either lost or won all levels
+            return observation, reward, True, info
+        # Both birds and pigs are left
+        return observation, reward, False, info
+
+    async def reset(self):
+        """ Reset the game, i.e., load the start level.
+        :returns: the screenshot of the start level
+        """
+        self.reset_count += 1
+        if self.reset_count > 50:
+            # Regularly restarts the environment
+            await self.restart()
+            self.reset_count = 0
+        if not await self.aibird_client.load_level(self.start_level):
+            print("Failed to load level {}".format(self.start_level))
+        self.action_count = 0
+        return await self._get_state()
+
+    async def terminate(self):
+        """ Terminate chrome and server. """
+        loop = asyncio.get_event_loop()
+        if self.aibird_client is not None:
+            await self.aibird_client.disconnect()
+        for proc in (self.chrome, self.server):
+            if proc is not None:
+                await loop.run_in_executor(None, safe_terminate, proc)
+
+    async def restart(self):
+        """ Restart chrome and server. """
+        await self.terminate()
+        loop = asyncio.get_event_loop()
+        self.chrome, self.server = await loop.run_in_executor(
+            None, prepare_env, self.server_path, self.chrome_user, self.client_port)
+        self.aibird_client = aibird_async_client.AsyncAIBirdClient(
+            port=self.client_port, delta_tile=self.delta_tile, **self.screenshot_config)
+        await self.aibird_client.connect()
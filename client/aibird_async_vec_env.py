@@ -0,0 +1,66 @@
+""" A vectorized env running every AsyncAIBirdEnv in one asyncio event loop """
+import asyncio
+from socket import timeout
+import numpy as np
+from baselines.common.vec_env import VecEnv
+
+
+class AsyncVecEnv(VecEnv):
+    def __init__(self, env_fns):
+        """
+        env_fns: list of coroutine functions, each returning a started AsyncAIBirdEnv
+
+        Every env runs in one event loop owned by this object, so N game
+        instances need neither N processes nor pickling observations over pipes.
+        """
+        self.waiting = False
+        self.closed = False
+        self.loop = asyncio.new_event_loop()
+        self.envs = []
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[env_fn() for env_fn in env_fns], return_exceptions=True))
+        self.envs = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Terminate the instances that did start, or their chrome and server leak
+            self.close()
+            raise errors[0]
+        self.actions = None
+        env = self.envs[0]
+        VecEnv.__init__(self, len(env_fns), env.observation_space, env.action_space)
+
+    def _run(self, *coros):
+        """Run `coros` concurrently and return their results in order."""
+        try:
+            return self.loop.run_until_complete(asyncio.gather(*coros))
+        except timeout:
+            self.close()
+            raise
+
+    async def _step(self, env, action):
+        ob, reward, done, info = await env.step(action)
+        if done:
+            ob = await env.reset()
+        return ob, reward, done, info
+
+    def step_async(self, actions):
+        self.actions = actions
+        self.waiting = True
+
+    def step_wait(self):
+        results = self._run(*[self._step(env, action)
+                              for env, action in zip(self.envs, self.actions)])
+        self.waiting = False
+        obs, rews, dones, infos = zip(*results)
+        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+
+    def reset(self):
+        return np.stack(self._run(*[env.reset() for env in self.envs]))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.run_until_complete(asyncio.gather(
+            *[env.terminate() for env in self.envs], return_exceptions=True))
+        self.loop.close()
@@ -0,0 +1,217 @@
+""" Benchmarks for the AIBird client
+
+Usage:
+    python aibird_benchmark.py screenshot [--host HOST] [--port PORT] [-n N]
+    python aibird_benchmark.py mock [-n N] [--latency SECONDS] [--frames FRAMES.npy]
+    python aibird_benchmark.py gae [-n N]
+    python aibird_benchmark.py preprocess [-n N] [--frames FRAMES.npy]
+    python aibird_benchmark.py mbr [-n N] [--frames FRAMES.npy] [--processes P]
+    python aibird_benchmark.py act [-n N]
+
+`screenshot` needs a running AIBird server. `mock` starts aibird_mock_server
+in a separate process and reports steps/sec, bytes/step and the round trip
+latency of every message type. `gae` needs no server and compares the
+vectorized advantage estimation with the Python loop it replaced.
+`preprocess` times the uint8 screenshot preprocessing modes. `mbr` reports
+the frames/sec of the client-side object detection of aibird_mbr, in this
+process and on a pool of worker processes. `act` needs tensorflow and
+compares the CnnPolicy step through feed_dict with its fused callable at
+batch sizes 1 to 64.
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+import aibird_client
+
+
+def timeit(func, repeat):
+    """Call `func` `repeat` times and return the elapsed seconds of each call."""
+    elapsed = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - tstart)
+    return np.asarray(elapsed)
+
+def report(name, elapsed, nbytes=None):
+    """Print a one line summary of `elapsed`."""
+    line = '{:<32} mean {:8.2f} ms  p50 {:8.2f} ms  p99 {:8.2f} ms'.format(
+        name, elapsed.mean() * 1e3, np.percentile(elapsed, 50) * 1e3,
+        np.percentile(elapsed, 99) * 1e3)
+    if nbytes is not None:
+        line += '  {:10d} bytes'.format(nbytes)
+    print(line)
+
+def bench_screenshot(client, repeat):
+    """Compare the PNG/Base64 screenshot with the raw screenshot."""
+    png = client.screenshot
+    raw = client.raw_screenshot
+    assert png.shape == raw.shape, (png.shape, raw.shape)
+    report('screenshot', timeit(lambda: client.screenshot, repeat))
+    report('raw_screenshot', timeit(lambda: client.raw_screenshot, repeat), raw.nbytes)
+
+def serve_mock(conn, frames_path, latency):
+    """Run a mock server on a free port and send the port through `conn`."""
+    import aibird_mock_server
+    frames = None if frames_path is None else np.load(frames_path, mmap_mode='r')
+    server = aibird_mock_server.MockServer(port=0, frames=frames, default_latency=latency)
+    conn.send(server.port)
+    server.serve_forever()
+
+def start_mock(frames_path=None, latency=0):
+    """Start a mock server process. Return the process and its port."""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve_mock, args=(child_conn, frames_path, latency),
+                                   daemon=True)
+    proc.start()
+    return proc, parent_conn.recv()
+
+def measure(client, func, repeat):
+    """Like timeit, but also return the mean number of bytes received per call."""
+    nbytes = client._reader.nbytes #pylint: disable=W0212
+    elapsed = timeit(func, repeat)
+    return elapsed, (client._reader.nbytes - nbytes) // repeat #pylint: disable=W0212
+
+def bench_mock(client, repeat):
+    """Round trip latency of every message type and env-like step throughput."""
+    def step():
+        _, state, _, _ = client.shoot_and_observe(30, 1)
+        if state.isover():
+            client.restart_level()
+
+    def delta_step():
+        client.delta_tile = aibird_client.DELTA_TILE
+        try:
+            step()
+        finally:
+            client.delta_tile = 0
+
+    requests = [
+        ('ready', client._ready), #pylint: disable=W0212
+        ('state', lambda: client.state),
+        ('score', lambda: client.current_score),
+        ('zoom_out', client.zoom_out),
+        ('polar_shoot', lambda: client.polar_shoot(30, 1)),
+        ('restart_level', client.restart_level),
+        ('screenshot', lambda: client.screenshot),
+        ('raw_screenshot', lambda: client.raw_screenshot),
+        ('delta_screenshot', lambda: client.delta_screenshot),
+        ('vision', lambda: client.vision),
+        ('polar_step', step),
+        ('polar_step_delta', delta_step),
+    ]
+    for name, func in requests:
+        client.restart_level()
+        elapsed, nbytes = measure(client, func, repeat)
+        report(name, elapsed, nbytes)
+    client.restart_level()
+    elapsed, nbytes = measure(client, step, repeat)
+    print('{:.1f} steps/sec, {} bytes/step'.format(repeat / elapsed.sum(), nbytes))
+
+def bench_gae(repeat):
+    """Vectorized GAE against the reference loop over rollout sizes."""
+    import aibird_gae
+    for nsteps in [128, 1024, 4096]:
+        for nenvs in [1, 8, 64]:
+            rollout = aibird_gae.random_rollout(nsteps, nenvs)
+            name = 'nsteps {:4d} nenvs {:2d}'.format(nsteps, nenvs)
+            report(name + ' loop', timeit(lambda: aibird_gae.gae_loop(*rollout, 0.99, 0.95), repeat))
+            report(name + ' scan', timeit(lambda: aibird_gae.gae(*rollout, 0.99, 0.95), repeat))
+
+def bench_preprocess(repeat, frames_path=None):
+    """uint8 crop and downsampling of one screenshot."""
+    import aibird_mock_server
+    import aibird_preprocess
+    if frames_path is None:
+        frame = aibird_mock_server.synthetic_frame(1, 3, 0)
+    else:
+        frame = np.load(frames_path, mmap_mode='r')[0]
+    for mode in ['area', 'stride']:
+        for factor in [1, 2, 4]:
+            obs = aibird_preprocess.process_screenshot(frame, factor, mode)
+            report('{} x{}'.format(mode, factor),
+                   timeit(lambda: aibird_preprocess.process_screenshot(frame, factor, mode), repeat),
+                   obs.nbytes)
+
+def bench_mbr(repeat, frames_path=None, processes=None):
+    """aibird_mbr.find_objects on recorded frames, or on frames painted in the
+    game's colours, serially and on a VisionPool.
+    """
+    import aibird_mbr
+    if frames_path is None:
+        frames = [aibird_mbr.synthetic_frame(level) for level in range(15)]
+    else:
+        frames = np.load(frames_path, mmap_mode='r')
+    frames = [np.asarray(frames[i % len(frames)]) for i in range(repeat)]
+    index = iter(range(repeat))
+    elapsed = timeit(lambda: aibird_mbr.find_objects(frames[next(index)]), repeat)
+    report('find_objects', elapsed)
+    print('{:.1f} frames/sec in 1 process'.format(repeat / elapsed.sum()))
+    with aibird_mbr.VisionPool(processes) as pool:
+        pool.map(frames[:1])
+        tstart = time.perf_counter()
+        pool.map(frames)
+        elapsed = time.perf_counter() - tstart
+    print('{:.1f} frames/sec in {} processes'.format(
+        repeat / elapsed, processes or multiprocessing.cpu_count()))
+
+def bench_act(repeat):
+    """CnnPolicy step latency: sess.run with a feed_dict against the callable."""
+    import gym
+    import tensorflow as tf
+    import aibird_policies
+    ob_space = gym.spaces.Box(low=0, high=255, shape=(189, 420, 3), dtype=np.uint8)
+    ac_space = gym.spaces.Discrete(60)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        policy = aibird_policies.CnnPolicy(sess, ob_space, ac_space, None, 1)
+        sess.run(tf.global_variables_initializer())
+        fetches = [policy.a0, policy.vf, policy.neglogp0]
+        for nbatch in [1, 2, 4, 8, 16, 32, 64]:
+            obs = np.random.randint(0, 256, (nbatch,) + ob_space.shape, dtype=np.uint8)
+            policy.step(obs)
+            report('batch {:2d} feed_dict'.format(nbatch),
+                   timeit(lambda: sess.run(fetches, {policy.X: obs}), repeat))
+            report('batch {:2d} callable'.format(nbatch), timeit(lambda: policy.step(obs), repeat))
+
+def main():
+    """ Run the benchmark given on the command line """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=['screenshot', 'mock', 'gae', 'preprocess', 'mbr', 'act'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=2004)
+    parser.add_argument('-n', '--repeat', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='mock server delay before every reply in seconds')
+    parser.add_argument('--frames', help='.npy file of recorded screenshots for the mock server')
+    parser.add_argument('--processes', type=int, help='worker processes of the mbr benchmark')
+    args = parser.parse_args()
+    if args.benchmark == 'gae':
+        bench_gae(args.repeat)
+        return
+    if args.benchmark == 'preprocess':
+        bench_preprocess(args.repeat, args.frames)
+        return
+    if args.benchmark == 'act':
+        bench_act(args.repeat)
+        return
+    if args.benchmark == 'mbr':
+        bench_mbr(args.repeat, args.frames, args.processes)
+        return
+    if args.benchmark == 'mock':
+        _, args.port = start_mock(args.frames, args.latency)
+    client = aibird_client.AIBirdClient(host=args.host, port=args.port)
+    client.connect()
+    try:
+        if args.benchmark == 'screenshot':
+            bench_screenshot(client, args.repeat)
+        else:
+            bench_mock(client, args.repeat)
+    finally:
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
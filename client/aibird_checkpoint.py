@@ -0,0 +1,163 @@
+"""Checkpoints of PPO2 training for aibird_ppo2
+
+A checkpoint is an .npz file holding the weights, the optimizer slots (Adam
+moments and beta powers) by variable name, the VecNormalize statistics of
+the env and the number of updates so far. save only pulls the values out of
+the session; a background thread writes them, atomically, and prunes the
+oldest checkpoints of the directory. load feeds placeholders whose assign
+ops are built once.
+
+Checkpoints of the former format, a joblib list of the weights, still load.
+
+Example:
+    checkpointer = Checkpointer(sess, params + trainer.variables(), keep=5)
+    checkpointer.save('checkpoints/00010.npz', env, update=10)
+    update = checkpointer.load(latest('checkpoints'), env)
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+import tensorflow as tf
+from baselines.common.vec_env.vec_normalize import VecNormalize
+
+EXTENSION = '.npz'
+VEC_NORMALIZE_STATS = ['ob_rms', 'ret_rms']
+UPDATE = 'learn/update'
+
+
+def latest(directory):
+    """Return the newest checkpoint file of `directory`, or None."""
+    if not os.path.isdir(directory):
+        return None
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if not name.endswith('.tmp')]
+    return max(paths, key=os.path.getctime) if paths else None
+
+def prune(directory, keep):
+    """Delete all but the `keep` last written checkpoints of `directory`.
+
+    The names are not used, since a run restarted without a checkpoint of
+    its own numbers its checkpoints from 1 again.
+    """
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if name.endswith(EXTENSION)]
+    paths.sort(key=lambda path: (os.path.getmtime(path), path))
+    for path in paths[:max(len(paths) - keep, 0)]:
+        os.remove(path)
+
+def find_vec_normalize(env):
+    """Return the VecNormalize among the wrappers of `env`, or None."""
+    while env is not None:
+        if isinstance(env, VecNormalize):
+            return env
+        env = getattr(env, 'venv', None)
+    return None
+
+def vec_normalize_arrays(env):
+    """The running mean, var and count of the VecNormalize of `env` by name."""
+    arrays = {}
+    venv = find_vec_normalize(env)
+    for stat in VEC_NORMALIZE_STATS:
+        rms = getattr(venv, stat, None)
+        if rms is not None:
+            for field in ['mean', 'var', 'count']:
+                arrays['vec_normalize/{}/{}'.format(stat, field)] = np.array(getattr(rms, field))
+    return arrays
+
+def restore_vec_normalize(env, arrays):
+    """Set the statistics of the VecNormalize of `env` saved in `arrays`."""
+    venv = find_vec_normalize(env)
+    for stat in VEC_NORMALIZE_STATS:
+        rms = getattr(venv, stat, None)
+        if rms is None:
+            continue
+        for field in ['mean', 'var', 'count']:
+            key = 'vec_normalize/{}/{}'.format(stat, field)
+            if key in arrays:
+                setattr(rms, field, arrays[key])
+
+
+class Checkpointer(object):
+    """Saves and restores `variables` of `sess`.
+
+    Args
+        sess -- session holding the variables
+        variables -- tf.Variables to checkpoint, e.g. params + trainer.variables()
+        keep -- number of checkpoints kept in the directory of every save
+    """
+    def __init__(self, sess, variables, keep=5):
+        self.sess = sess
+        self.variables = list(variables)
+        self.names = [var.op.name for var in self.variables]
+        self.keep = keep
+        self._placeholders = [tf.placeholder(var.dtype.base_dtype, var.shape)
+                              for var in self.variables]
+        self._assigns = [var.assign(placeholder)
+                         for var, placeholder in zip(self.variables, self._placeholders)]
+        # At most one checkpoint waits for the writer, which bounds the memory
+        self._pending = queue.Queue(maxsize=1)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def save(self, path, env=None, update=None, vec_normalize=None):
+        """Snapshot the variables, the VecNormalize of `env` and the number of
+        updates `update`, and write them to `path` in the background.
+
+        `vec_normalize`, the vec_normalize_arrays taken earlier, replaces the
+        statistics of `env`; pass it when another thread steps `env`.
+        """
+        self._raise_error()
+        arrays = dict(zip(self.names, self.sess.run(self.variables)))
+        arrays.update(vec_normalize_arrays(env) if vec_normalize is None else vec_normalize)
+        if update is not None:
+            arrays[UPDATE] = np.array(update)
+        self._pending.put((path, arrays))
+
+    def _write_loop(self):
+        while True:
+            path, arrays = self._pending.get()
+            try:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as fh:
+                    np.savez(fh, **arrays)
+                os.replace(tmp_path, path)
+                if self.keep:
+                    prune(os.path.dirname(path) or '.', self.keep)
+            except Exception as e: #pylint: disable=W0703
+                self._error = e
+            finally:
+                self._pending.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """Block until every saved checkpoint is on disk."""
+        self._pending.join()
+        self._raise_error()
+
+    def load(self, path, env=None):
+        """Restore the variables found in `path`, and the VecNormalize of `env`.
+        Return the number of updates saved with the checkpoint, or None.
+
+        Variables missing from the checkpoint, such as the optimizer slots of
+        a checkpoint of the former format, keep their values.
+        """
+        if not path.endswith(EXTENSION):
+            import joblib
+            # Former format: the list of weights, in the order of `variables`
+            arrays = dict(zip(self.names, joblib.load(path)))
+        else:
+            with np.load(path) as npz:
+                arrays = dict(npz.items())
+        feed = {placeholder: arrays[name]
+                for name, placeholder in zip(self.names, self._placeholders) if name in arrays}
+        self.sess.run([assign for name, assign in zip(self.names, self._assigns)
+                       if name in arrays], feed)
+        restore_vec_normalize(env, arrays)
+        return int(arrays[UPDATE]) if UPDATE in arrays else None
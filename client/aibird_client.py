@@ -2,15 +2,20 @@
 import base64
 import io
 import socket
+from time import sleep, time
 
 import numpy as np
 from PIL import Image
 
 import aibird_message
+from aibird_reader import FramedReader
 
 TIMEOUT = 60         # Timeout value for the socket
 MAXTRIALS = 5       # Max number of zoom tries
 DOWNSCALEFACTOR = 2
+BACKOFF_MIN = 0.05   # First retry delay of wait_ready in seconds
+BACKOFF_MAX = 2      # Longest retry delay of wait_ready in seconds
+DELTA_TILE = 24      # Default tile size of delta screenshots, divides 840 x 480
 
 # FOCUS = [
 #     (194, 326),     # Level 1
@@ -42,6 +47,13 @@ class AIBirdClient:
     Attributes
         host (str): address of AIBird Server. Default is `localhost`
         port (int): port of AIBird Server. Default is `2004`
+        delta_tile (int): if positive, shoot_and_observe receives delta
+            screenshots with tiles of this size. Default is `0`
+        roi (tuple): (left, top, width, height) the server crops raw, delta and
+            step screenshots to; a width or height of 0 extends to the edge.
+            Default is `None`, the whole screen
+        scale (int): integer factor the server shrinks them by. Default is `1`
+        grayscale (bool): if True they arrive with one luma channel. Default is `False`
 
     Usage:
         client = AIBirdClient()
@@ -51,19 +63,81 @@ class AIBirdClient:
         shoot = process_screenshot(img)     # A user defined function
         client.polar_shoot(*shoot)
     """
-    def __init__(self, host='localhost', port=2004):
+    def __init__(self, host='localhost', port=2004, delta_tile=0,
+                 roi=None, scale=1, grayscale=False):
         self.host = host
         self.port = port
+        self.delta_tile = delta_tile
+        self.roi = roi
+        self.scale = scale
+        self.grayscale = grayscale
         self.socket = None
+        self._reader = None
+        self._delta = DeltaFrame()
         self._scores = [0] * 21
         self._current_level = 1
 
-    def connect(self):
-        """Connect to AIBird server."""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(TIMEOUT)
-        self.socket.connect((self.host, self.port))
+    def connect(self, timeout=TIMEOUT):
+        """Connect to AIBird server and load the current level.
+
+        Waits up to `timeout` seconds for the server to become ready.
+        Return the seconds each startup phase took (see wait_ready), plus
+        `level` for loading the level.
+        """
+        phases = self.wait_ready(timeout)
+        tstart = time()
+        if self.roi is not None or self.scale != 1 or self.grayscale:
+            if not self.configure_screenshot(self.roi, self.scale, self.grayscale):
+                raise ValueError('AIBird server rejected roi {}, scale {}'.format(
+                    self.roi, self.scale))
         self._load_level(self._current_level)
+        phases['level'] = time() - tstart
+        return phases
+
+    def wait_ready(self, timeout=TIMEOUT):
+        """Connect to AIBird server as soon as it is ready, retrying with
+        exponential backoff.
+
+        Return the seconds each phase took as a dict:
+            server -- until the server accepted the connection
+            proxy -- until the browser was connected to the server's proxy
+            browser -- until the game left the loading screens
+        Raise socket.timeout if the server is not ready within `timeout` seconds.
+        """
+        tstart = time()
+        deadline = tstart + timeout
+        phases = {}
+        delay = BACKOFF_MIN
+        while True:
+            try:
+                self.socket = socket.create_connection(
+                    (self.host, self.port), timeout=max(deadline - time(), BACKOFF_MIN))
+                break
+            except ConnectionRefusedError:
+                if time() + delay > deadline:
+                    raise socket.timeout('AIBird server at port {} not up'.format(self.port))
+                sleep(delay)
+                delay = min(delay * 2, BACKOFF_MAX)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = FramedReader(self.socket)
+        self._delta = DeltaFrame()
+        phases['server'] = time() - tstart
+        delay = BACKOFF_MIN
+        state = self._ready()
+        phases['proxy'] = time() - tstart
+        while not state.isready():
+            if time() + delay > deadline:
+                raise socket.timeout('AIBird game at port {} not loaded'.format(self.port))
+            sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+            state = self._ready()
+        phases['browser'] = time() - tstart
+        self.socket.settimeout(TIMEOUT)
+        return phases
+
+    def _ready(self):
+        self.socket.sendall(aibird_message.get_ready())
+        return aibird_message.recv_state(self._reader.read(aibird_message.LEN_READY))
 
     def disconnect(self):
         """Disconnect from AIBird server."""
@@ -100,17 +174,81 @@ class AIBirdClient:
     def screenshot(self):
         """ A numpy array containing the screenshot"""
         self.socket.sendall(aibird_message.get_screenshot())
+        return self._recv_screenshot()
+
+    def _recv_screenshot(self):
         size = aibird_message.recv_screenshot_size(
-            self.socket.recv(aibird_message.LEN_SCREENSHOT))
-        # print(size, width, height)
-        data = b''
-        while len(data) < size:
-            packet = self.socket.recv(size - len(data))
-            data += packet
+            self._reader.read(aibird_message.LEN_SCREENSHOT))
+        data = self._reader.read(size, slot='payload')
         img = np.array(Image.open(io.BytesIO(base64.b64decode(data))))
         return img
         #return rescale(img, 1/DOWNSCALEFACTOR)  # The blue bird is almost invisible.
 
+    @property
+    def raw_screenshot(self):
+        """ A numpy array containing the screenshot, sent without any encoding.
+
+        The array is a view of a buffer that the next raw screenshot overwrites.
+        Copy it if it has to outlive the next call.
+        """
+        self.socket.sendall(aibird_message.get_raw_screenshot())
+        return self._recv_raw_screenshot()
+
+    def _recv_raw_screenshot(self):
+        width, height, channels, dtype = aibird_message.recv_raw_screenshot_header(
+            self._reader.read(aibird_message.LEN_RAW_SCREENSHOT_HEADER))
+        dtype = np.dtype(dtype)
+        data = self._reader.read(width * height * channels * dtype.itemsize, slot='frame')
+        return np.frombuffer(data, dtype).reshape(height, width, channels)
+
+    @property
+    def delta_screenshot(self):
+        """ A numpy array containing the screenshot, patched in place with the
+        tiles that changed since the last delta screenshot.
+
+        The array is a view of a frame owned by the client that the next delta
+        screenshot updates. Copy it if it has to outlive the next call.
+        """
+        self.socket.sendall(aibird_message.get_delta_screenshot(self.delta_tile or DELTA_TILE))
+        return self._recv_delta_screenshot()
+
+    def _recv_delta_screenshot(self):
+        width, height, channels, dtype, tile, count = \
+            aibird_message.recv_delta_screenshot_header(
+                self._reader.read(aibird_message.LEN_DELTA_SCREENSHOT_HEADER))
+        dtype = np.dtype(dtype)
+        indices = self._reader.read(4 * count, slot='indices')
+        tiles = self._reader.read(count * tile * tile * channels * dtype.itemsize, slot='frame')
+        return self._delta.patch(width, height, channels, dtype, tile, indices, tiles)
+
+    @property
+    def vision(self):
+        """ Objects the server detects in the current screenshot, see
+        aibird_message.recv_vision_objects.
+        """
+        self.socket.sendall(aibird_message.get_vision())
+        return self._recv_vision()
+
+    def _recv_vision(self):
+        count = aibird_message.recv_vision_count(
+            self._reader.read(aibird_message.LEN_VISION_COUNT))
+        return aibird_message.recv_vision_objects(
+            self._reader.read(count * aibird_message.LEN_VISION_OBJECT, slot='payload'))
+
+    def configure_screenshot(self, roi=None, scale=1, grayscale=False):
+        """Register with the server how to reduce raw, delta and step screenshots.
+        See the attributes of the same name. They are registered again on
+        every connect.
+
+        Return True if the server accepted them, False otherwise.
+        """
+        color = aibird_message.COLOR_GRAY if grayscale else aibird_message.COLOR_RGB
+        result = self._send_and_recv_result(
+            aibird_message.configure_screenshot(*(roi or (0, 0, 0, 0)), scale, color))
+        if result:
+            self.roi, self.scale, self.grayscale = roi, scale, grayscale
+        return result
+
     @property
     def state(self):
         """Get current state
@@ -118,12 +256,18 @@ class AIBirdClient:
         Return a GameState object.
         """
         self.socket.sendall(aibird_message.get_state())
-        return aibird_message.recv_state(self.socket.recv(aibird_message.LEN_GET_STATE))
+        return self._recv_state()
+
+    def _recv_state(self):
+        return aibird_message.recv_state(self._reader.read(aibird_message.LEN_GET_STATE))
 
     def _get_score(self):
         """Request the server for my score"""
         self.socket.sendall(aibird_message.get_my_score())
-        return aibird_message.recv_score(self.socket.recv(aibird_message.LEN_GET_SCORE))
+        return self._recv_score()
+
+    def _recv_score(self):
+        return aibird_message.recv_score(self._reader.read(aibird_message.LEN_GET_SCORE))
 
     def _get_cached_score(self):
         return self._scores[self._current_level - 1]
@@ -134,7 +278,34 @@ class AIBirdClient:
         Return True if succeeded, False otherwise.
         """
         self.socket.sendall(msg)
-        return aibird_message.recv_result(self.socket.recv(aibird_message.LEN_ETC))
+        return self._recv_result()
+
+    def _recv_result(self):
+        return aibird_message.recv_result(self._reader.read(aibird_message.LEN_ETC))
+
+    def pipeline(self):
+        """Return a Pipeline that sends several requests in one go."""
+        return Pipeline(self)
+
+    def _zoom_out_fully(self):
+        for _ in range(MAXTRIALS):
+            if self.zoom_out():
+                break
+        else:
+            raise Exception('cart_shoot: reached MAXTRIALS')
+
+    def _shoot(self, msg):
+        """Send the shot `msg` together with a score request.
+
+        Return the score gained by the shot if accepted, -1 if rejected.
+        """
+        result, score = self.pipeline().request(
+            msg, self._recv_result).get_my_score().execute()
+        if result:
+            initial_score = self._get_cached_score()
+            self._scores[self._current_level - 1] = score
+            return score - initial_score
+        return -1
 
     def cart_shoot(self, dx, dy, tap_time, mode='safe'):
         """Send cart_shoot request.
@@ -145,25 +316,15 @@ class AIBirdClient:
             dx, dy -- relative x, y coordinate of release point
             tap_time -- in seconds
 
-        Return True if accepted, False if rejected.
+        Return the score gained by the shot if accepted, -1 if rejected.
         """
         # level = self.current_level
         # fx, fy = FOCUS[level - 1]
-        for _ in range(MAXTRIALS):
-            if self.zoom_out():
-                break
-        else:
-            raise Exception('cart_shoot: reached MAXTRIALS')
-
-        result = self._send_and_recv_result(
-            aibird_message.cart_shoot(dx, dy, tap_time, mode))
-        if result:
-            initial_score = self._get_cached_score()
-            return self.current_score - initial_score
-        return -1
+        self._zoom_out_fully()
+        return self._shoot(aibird_message.cart_shoot(dx, dy, tap_time, mode))
 
     def polar_shoot(self, theta, tap_time, mode='safe'):
-        """Send cart_shoot request.
+        """Send polar_shoot request.
 
         It assumes that the screen is fully zoomed out.
 
@@ -171,21 +332,48 @@ class AIBirdClient:
             theta -- the angular coordinate by degree from -90.00 to 90.00.
             tap_time -- in seconds
 
-        Return True if accepted, False if rejected.
+        Return the score gained by the shot if accepted, -1 if rejected.
         """
         # level = self.current_level
         # fx, fy = FOCUS[level - 1]
-        for _ in range(MAXTRIALS):
-            if self.zoom_out():
-                break
+        self._zoom_out_fully()
+        return self._shoot(aibird_message.polar_shoot(50, theta, tap_time, mode)) # always shoot max
+
+    def shoot_and_observe(self, theta, tap_time):
+        """Zoom out, shoot and observe the outcome with a single request.
+
+        The server waits until the score settles as in a safe polar shoot.
+
+        Args
+            theta -- the angular coordinate by degree from -90.00 to 90.00.
+            tap_time -- in seconds
+
+        Return (reward, state, birds, frame) where reward is the score gained by
+        the shot, state is a GameState object, birds is the number of birds left
+        and frame is a raw screenshot taken after the shot, or a delta
+        screenshot if delta_tile is set.
+        """
+        if self.delta_tile:
+            self.socket.sendall(aibird_message.polar_step_delta(50, theta, tap_time,
+                                                                self.delta_tile))
         else:
-            raise Exception('cart_shoot: reached MAXTRIALS')
-        result = self._send_and_recv_result(
-            aibird_message.polar_shoot(50, theta, tap_time, mode)) # always shoot max
-        if result:
-            initial_score = self._get_cached_score()
-            return self.current_score - initial_score
-        return -1
+            self.socket.sendall(aibird_message.polar_step(50, theta, tap_time)) # always shoot max
+        reward, state, birds = aibird_message.recv_step(
+            self._reader.read(aibird_message.LEN_STEP))
+        self._scores[self._current_level - 1] += reward
+        if self.delta_tile:
+            return reward, state, birds, self._recv_delta_screenshot()
+        return reward, state, birds, self._recv_raw_screenshot()
+
+    def shoot_and_detect(self, theta, tap_time):
+        """Like shoot_and_observe, but return the objects the server detects
+        after the shot (see `vision`) instead of a screenshot.
+        """
+        self.socket.sendall(aibird_message.polar_step_vision(50, theta, tap_time))
+        reward, state, birds = aibird_message.recv_step(
+            self._reader.read(aibird_message.LEN_STEP))
+        self._scores[self._current_level - 1] += reward
+        return reward, state, birds, self._recv_vision()
 
     def zoom_in(self):
         """Send zoom in request.
@@ -222,10 +410,130 @@ class AIBirdClient:
         result = self._send_and_recv_result(aibird_message.load_level(level))
         if result:
             self._current_level = level
+            self._scores[level - 1] = 0
         return result
 
     def restart_level(self):
         """Send restart level request.
         Return True if succeeded, False otherwise.
         """
-        return self._send_and_recv_result(aibird_message.restart_level())
+        result = self._send_and_recv_result(aibird_message.restart_level())
+        if result:
+            self._scores[self._current_level - 1] = 0
+        return result
+
+
+class DeltaFrame:
+    """Frame reassembled from delta screenshots.
+
+    The frame is stored zero padded to whole tiles, so that the tiles of one
+    delta screenshot are written with a single vectorized assignment.
+    """
+    def __init__(self):
+        self.padded = None
+
+    def patch(self, width, height, channels, dtype, tile, indices, tiles):
+        """Write `tiles` at the row major tile `indices` and return the frame.
+
+        Arguments
+        indices -- buffer of network order int32 tile indices
+        tiles -- buffer of the tile x tile x channels tiles, in the same order
+        """
+        tiles_y, tiles_x = -(-height // tile), -(-width // tile)
+        shape = (tiles_y * tile, tiles_x * tile, channels)
+        if self.padded is None or self.padded.shape != shape or self.padded.dtype != dtype:
+            # The server sends every tile when the size changes
+            self.padded = np.zeros(shape, dtype)
+        indices = np.frombuffer(indices, '>i4')
+        grid = self.padded.reshape(tiles_y, tile, tiles_x, tile, channels).swapaxes(1, 2)
+        grid[indices // tiles_x, indices % tiles_x] = np.frombuffer(tiles, dtype).reshape(
+            len(indices), tile, tile, channels)
+        return self.padded[:height, :width]
+
+
+class Pipeline:
+    """Queues requests to the AIBird server and sends them with one sendall.
+
+    The server handles requests in the order they arrive, so `execute` reads
+    the responses back in the same order. Every queuing method returns the
+    pipeline itself so that calls can be chained. The results are returned
+    as-is: unlike the corresponding AIBirdClient methods, the pipeline does
+    not update the cached scores. A raw screenshot is a view of the client's
+    frame buffer, so only the last one queued survives `execute`.
+
+    Usage:
+        zoomed, score, state = client.pipeline().zoom_out().get_my_score().get_state().execute()
+    """
+    def __init__(self, client):
+        self._client = client
+        self._messages = []
+        self._receivers = []
+
+    def __len__(self):
+        return len(self._messages)
+
+    def request(self, msg, receive):
+        """Queue `msg`, whose response is parsed by calling `receive()`."""
+        self._messages.append(msg)
+        self._receivers.append(receive)
+        return self
+
+    def execute(self):
+        """Send every queued request and return their results in order."""
+        messages, receivers = self._messages, self._receivers
+        self._messages, self._receivers = [], []
+        self._client.socket.sendall(b''.join(messages))
+        return [receive() for receive in receivers]
+
+    def get_screenshot(self):
+        """Queue a screenshot request."""
+        return self.request(aibird_message.get_screenshot(), self._client._recv_screenshot)
+
+    def get_raw_screenshot(self):
+        """Queue a raw screenshot request."""
+        return self.request(aibird_message.get_raw_screenshot(),
+                            self._client._recv_raw_screenshot)
+
+    def get_delta_screenshot(self):
+        """Queue a delta screenshot request."""
+        return self.request(
+            aibird_message.get_delta_screenshot(self._client.delta_tile or DELTA_TILE),
+            self._client._recv_delta_screenshot)
+
+    def get_vision(self):
+        """Queue a vision request. Its result is an array of objects."""
+        return self.request(aibird_message.get_vision(), self._client._recv_vision)
+
+    def get_state(self):
+        """Queue a state request. Its result is a GameState object."""
+        return self.request(aibird_message.get_state(), self._client._recv_state)
+
+    def get_my_score(self):
+        """Queue a score request."""
+        return self.request(aibird_message.get_my_score(), self._client._recv_score)
+
+    def cart_shoot(self, dx, dy, tap_time, mode='safe'):
+        """Queue a Cartesian shoot request. Its result is True if accepted."""
+        return self.request(aibird_message.cart_shoot(dx, dy, tap_time, mode),
+                            self._client._recv_result)
+
+    def polar_shoot(self, r, theta, tap_time, mode='safe'):
+        """Queue a polar shoot request. Its result is True if accepted."""
+        return self.request(aibird_message.polar_shoot(r, theta, tap_time, mode),
+                            self._client._recv_result)
+
+    def zoom_out(self):
+        """Queue a zoom out request. Its result is True if succeeded."""
+        return self.request(aibird_message.zoom_out(), self._client._recv_result)
+
+    def zoom_in(self):
+        """Queue a zoom in request. Its result is True if succeeded."""
+        return self.request(aibird_message.zoom_in(), self._client._recv_result)
+
+    def click_in_center(self):
+        """Queue a click in center request. Its result is True if succeeded."""
+        return self.request(aibird_message.click_in_center(), self._client._recv_result)
+
+    def restart_level(self):
+        """Queue a restart level request. Its result is True if succeeded."""
+        return self.request(aibird_message.restart_level(), self._client._recv_result)
@@ -46,12 +46,9 @@ class PdType(object):
         return tf.placeholder(dtype=self.sample_dtype(), shape=prepend_shape+self.sample_shape(), name=name)
 
 class CategoricalPdType(PdType):
-    def __init__(self, ncat, test=False):
+    def __init__(self, ncat):
         self.ncat = ncat
-        self.test = test
     def pdclass(self):
-        if self.test:
-            return CategoricalPdTest
         return CategoricalPd
     def pdfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
         pdparam = fc(latent_vector, 'pi', self.ncat, init_scale=init_scale, init_bias=init_bias)
@@ -105,49 +102,9 @@ class CategoricalPd(Pd):
     def fromflat(cls, flat):
         return cls(flat)
 
-class CategoricalPdTest(Pd):
-    def __init__(self, logits):
-        self.logits = logits
-    def flatparam(self):
-        return self.logits
-    def mode(self):
-        return tf.argmax(self.logits, axis=-1)
-    def neglogp(self, x):
-        # return tf.nn.sparse_softmax_cross_entropy_with_logits(logits=self.logits, labels=x)
-        # Note: we can't use sparse_softmax_cross_entropy_with_logits because
-        #       the implementation does not allow second-order derivatives...
-        one_hot_actions = tf.one_hot(x, self.logits.get_shape().as_list()[-1])
-        return tf.nn.softmax_cross_entropy_with_logits(
-            logits=self.logits,
-            labels=one_hot_actions)
-
-    def kl(self, other):
-        a0 = self.logits - tf.reduce_max(self.logits, axis=-1, keep_dims=True)
-        a1 = other.logits - tf.reduce_max(other.logits, axis=-1, keep_dims=True)
-        ea0 = tf.exp(a0)
-        ea1 = tf.exp(a1)
-        z0 = tf.reduce_sum(ea0, axis=-1, keep_dims=True)
-        z1 = tf.reduce_sum(ea1, axis=-1, keep_dims=True)
-        p0 = ea0 / z0
-        return tf.reduce_sum(p0 * (a0 - tf.log(z0) - a1 + tf.log(z1)), axis=-1)
-    
-    def entropy(self):
-        a0 = self.logits - tf.reduce_max(self.logits, axis=-1, keep_dims=True)
-        ea0 = tf.exp(a0)
-        z0 = tf.reduce_sum(ea0, axis=-1, keep_dims=True)
-        p0 = ea0 / z0
-        return tf.reduce_sum(p0 * (tf.log(z0) - a0), axis=-1)
-
-    def sample(self):
-        return tf.argmax(self.logits, axis=-1)
-
-    @classmethod
-    def fromflat(cls, flat):
-        return cls(flat)
-
-def make_pdtype(ac_space, test=False):
+def make_pdtype(ac_space):
     from gym import spaces
-    return CategoricalPdType(ac_space.n, test)
+    return CategoricalPdType(ac_space.n)
 
 def shape_el(v, i):
     maybe = v.get_shape()[i]
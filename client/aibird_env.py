@@ -1,26 +1,43 @@
 """ An OpenAI environment interface for AIBird client """
-from time import sleep
+import functools
+import os
+import socket
+import subprocess
+from time import sleep, time
 
 import numpy as np
 import psutil
-from scipy.stats import logistic
 
 import gym
+import aibird_actions
 import aibird_client
+import aibird_features
 
 class AIBirdEnv(gym.Env):
     """OpenAI Environment for AIBird
 
     Args
     max_action, min_action -- numpy array holding the values
-    process_state -- function for preprocessing state
-                     default value: do nothing
+    process_state -- function for preprocessing state. It receives a raw screenshot
+                     that the next screenshot overwrites, so it must not return it as-is
+                     default value: copy
     process_action -- function for processing action
                       default value: map (-infty, infty) to action space via sigmoid
+                      np.asarray if a wrapping ActionMapVecEnv already maps it
+    delta_tile -- if positive, receive screenshots as delta screenshots with tiles
+                  of this size, which only carry what changed since the last one
+    roi, scale, grayscale -- reduction the server applies to screenshots before
+                             sending them, see AIBirdClient
+    observation -- 'pixels' for screenshots, 'vision' for a (max_objects, n) float32
+                   tensor of the objects the server detects (see aibird_features).
+                   process_state, delta_tile, roi, scale and grayscale only apply to pixels
     """
 
     def __init__(self, action_space, act_cont,
-                 process_state=lambda x: x, process_action=None, start_level=1):
+                 process_state=np.array, process_action=None, start_level=1, delta_tile=0,
+                 roi=None, scale=1, grayscale=False, observation='pixels', max_objects=32):
+        if observation not in ('pixels', 'vision'):
+            raise ValueError('Unknown observation {}'.format(observation))
         self.observation_space = None
         self.chrome = None
         self.server = None
@@ -28,61 +45,94 @@ class AIBirdEnv(gym.Env):
         self.server_path = None
         self.chrome_user = None
         self.client_port = None
+        self.pool = None
+        self.instance = None
         self.reset_count = 0
+        self.startup_times = None
+        self._launched_at = None
         self.start_level = start_level
+        self.delta_tile = delta_tile
+        self.screenshot_config = dict(roi=roi, scale=scale, grayscale=grayscale)
         if act_cont:
             self.action_space = gym.spaces.Box(
                 low=action_space[0], high=action_space[1], dtype=np.float64)
         else:
             self.action_space = gym.spaces.Discrete(action_space)
         self.action_count = 0
+        self.observation = observation
+        self._features = aibird_features.VisionFeatures(max_objects)
         self._process_state = process_state
         if process_action is None:
-            def sigmoid(paction):
-                """ Rescale (-infty, infty) to [-lower_bound, upper_bound] """
-                action = []
-                for act, amin, amax in zip(paction, action_space[0], action_space[1]):
-                    scale = amax - amin
-                    action.append(logistic.cdf(act) * scale + amin)
-                return np.asarray(action)
-            self._process_action = sigmoid
+            # Rescale (-infty, infty) to [lower_bound, upper_bound]
+            self._process_action = aibird_actions.Squash(action_space[0], action_space[1])
         else:
             self._process_action = process_action
 
     def startup(self, server_path, chrome_user, client_port):
         """Setups the AIBird client. Must be called before anything else.
         """
+        self._launched_at = time()
         self.chrome, self.server = prepare_env(server_path, chrome_user, client_port)
         self.server_path = server_path
         self.chrome_user = chrome_user
         self.client_port = client_port
-        self.aibird_client = aibird_client.AIBirdClient(port=client_port)
-        self.aibird_client.connect()
+        self._connect()
+
+    def startup_from_pool(self, pool):
+        """Setups the AIBird client on an instance of the InstancePool `pool`.
+        Can be called instead of `startup`. Restarts then swap in another
+        instance of the pool instead of relaunching chrome and server.
+        """
+        self.pool = pool
+        self.server_path = pool.server_path
+        self._launched_at = time()
+        self._use_instance(pool.acquire())
+        self._connect()
+
+    def _use_instance(self, instance):
+        self.instance = instance
+        self.chrome, self.server = instance.chrome, instance.server
+        self.chrome_user, self.client_port = instance.chrome_user, instance.client_port
+
+    def _connect(self):
+        self._connect_client()
+        if self.observation == 'vision':
+            self.observation_space = self._features.observation_space
+            return
         screenshot = self._get_state()
         self.observation_space = gym.spaces.Box(
             low=0, high=255, shape=screenshot.shape, dtype=screenshot.dtype)
 
     def _get_state(self):
         """ Get screenshot from AIBird Client and process it. """
-        return self._process_state(self.aibird_client.screenshot)
+        if self.observation == 'vision':
+            return self._features(self.aibird_client.vision)
+        if self.delta_tile:
+            return self._process_state(self.aibird_client.delta_screenshot)
+        return self._process_state(self.aibird_client.raw_screenshot)
 
     def step(self, action):
         """Executes `action` and returns the reward. """
-        score = self.aibird_client.current_score
         processed_action = self._process_action(action)
-        reward = self.aibird_client.polar_shoot(*processed_action)
-        observation = self._get_state()
-        state = self.aibird_client.state
+        if self.observation == 'vision':
+            reward, state, birds, objects = self.aibird_client.shoot_and_detect(
+                *processed_action)
+            observation = self._features(objects)
+        else:
+            reward, state, birds, frame = self.aibird_client.shoot_and_observe(
+                *processed_action)
+            observation = self._process_state(frame)
+        info = {'birds': birds, 'state': state.state}
         if state.isover():
             if state.won():
                 if self.aibird_client.next_level():
                     # Proceed to next level
                     observation = self._get_state()
-                    return observation, reward, False, dict()
+                    return observation, reward, False, info
             # Either lost or won all levels
-            return observation, reward, True, dict()
+            return observation, reward, True, info
         # Both birds and pigs are left
-        return observation, reward, False, dict()
+        return observation, reward, False, info
 
     def render(self, mode='human'):
         """ Since the actual AI Bird game is running, render is unnecessary.
@@ -106,6 +156,9 @@ class AIBirdEnv(gym.Env):
         """ Terminate chrome and server. """
         if self.aibird_client is not None:
             self.aibird_client.disconnect()
+        if self.instance is not None:
+            self.pool.release(self.instance)
+            self.instance = self.chrome = self.server = None
         if self.chrome is not None:
             safe_terminate(self.chrome)
         if self.server is not None:
@@ -114,28 +167,96 @@ class AIBirdEnv(gym.Env):
     def restart(self):
         """ Restart chrome and server. """
         self.terminate()
-        self.chrome, self.server = prepare_env(self.server_path, self.chrome_user, self.client_port)
-        self.aibird_client = aibird_client.AIBirdClient(port=self.client_port)
-        self.aibird_client.connect()
+        self._launched_at = time()
+        if self.pool is not None:
+            self._use_instance(self.pool.acquire())
+        else:
+            self.chrome, self.server = prepare_env(
+                self.server_path, self.chrome_user, self.client_port)
+        self._connect_client()
+
+    def _connect_client(self):
+        """ Connect to the server and record how long each startup phase took. """
+        launch = time() - self._launched_at
+        self.aibird_client = aibird_client.AIBirdClient(
+            port=self.client_port, delta_tile=self.delta_tile, **self.screenshot_config)
+        phases = self.aibird_client.connect(STARTUP_TIMEOUT)
+        self.startup_times = dict(launch=launch, **phases)
+        print('Env', self.chrome_user, 'ready:', ', '.join(
+            '{} {:.1f} s'.format(phase, seconds) for phase, seconds in self.startup_times.items()))
+
+SERVER_JAR = os.path.join('build', 'jar', 'AIBirdServer.jar')
+SERVER_STARTUP = 60     # Max seconds for the server to open the client port
+STARTUP_TIMEOUT = 120   # Max seconds for the browser to connect and the level to load
+SERVER_TRIALS = 3       # Max number of server launches
 
 def prepare_env(server_path, chrome_user, client_port):
+    """ Launch chrome and the server. The browser connects to the server on
+    its own; AIBirdClient.wait_ready tells when that has happened.
+    """
     print('Preparing env', chrome_user, client_port)
+    build_server(server_path)
+    chrome = launch_chrome(chrome_user)
+    try:
+        server = start_server(server_path, chrome_user, client_port)
+    except socket.timeout:
+        safe_terminate(chrome)
+        raise
+    return chrome, server
+
+@functools.lru_cache(maxsize=None)
+def build_server(server_path):
+    """ Compile the server jar once per process. Later launches reuse it. """
+    subprocess.run(['ant', 'jar'], cwd=server_path, check=True,
+                   stdout=subprocess.DEVNULL)
+
+def launch_chrome(chrome_user):
+    """ Start chrome with the AIBird profile `chrome_user`. """
     with open('log/chrome{}.error'.format(chrome_user), 'a') as chrome_error:
-        chrome = psutil.Popen(['google-chrome-stable', 'chrome.angrybirds.com',
-                               '--profile-directory=Profile {}'.format(chrome_user)],
-                              stderr=chrome_error)
-    sleep(10)
+        return psutil.Popen(['google-chrome-stable', 'chrome.angrybirds.com',
+                             '--profile-directory=Profile {}'.format(chrome_user)],
+                            stderr=chrome_error)
+
+def launch_server(server_path, chrome_user, client_port):
+    """ Start the pre-built server jar talking to chrome `chrome_user`. """
+    classpath = os.pathsep.join([SERVER_JAR, os.path.join('lib', '*')])
     with open('log/server{}.log'.format(chrome_user), 'a') as server_log:
-        while True:
-            server = psutil.Popen(["ant", "-Dproxyport={}".format(8999 + chrome_user),
-                                   "-Dclientport={}".format(client_port)],
-                                  cwd=server_path, stdout=server_log)
-            gone, _ = psutil.wait_procs([server], timeout=3)
-            if not gone:
-                break
-        
-    sleep(7)
-    return chrome, server
+        return psutil.Popen(['java', '-Dproxyport={}'.format(8999 + chrome_user),
+                             '-cp', classpath, 'ab.AIBirdServer', str(client_port)],
+                            cwd=server_path, stdout=server_log)
+
+def start_server(server_path, chrome_user, client_port):
+    """ Launch the server until it opens the client port. """
+    for _ in range(SERVER_TRIALS):
+        server = launch_server(server_path, chrome_user, client_port)
+        if wait_for_port(client_port, proc=server):
+            return server
+        safe_terminate(server)
+    raise socket.timeout('AIBird server did not open port {}'.format(client_port))
+
+def wait_for_port(port, timeout=SERVER_STARTUP, host='localhost', proc=None):
+    """ Poll until `port` accepts connections.
+
+    Return True if it did within `timeout` seconds, False otherwise or as soon
+    as `proc`, the process expected to open it, has exited.
+    """
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            if proc is not None and not is_alive(proc):
+                return False
+            sleep(0.1)
+    return False
+
+def is_alive(proc):
+    """ Return True if the psutil Process `proc` is running. """
+    try:
+        return proc.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
 
 def safe_terminate(proc):
     """ Send SIGTERM to the process and its child processes. If it does not terminates, kill it.
@@ -0,0 +1,51 @@
+"""Fixed-size observations built from the objects the AIBird server detects
+
+Every detected object becomes one row: a one-hot type, a one-hot shape and
+its bounding box (x, y, width, height) divided by the screen size. Rows past
+the last object are zero, so a row is padding exactly when it has no type.
+
+Example:
+    features = VisionFeatures(max_objects=32)
+    obs = features(client.vision)       # (32, features.nfeatures) float32
+"""
+import numpy as np
+import gym
+
+import aibird_message
+
+SCREEN_WIDTH = 840
+SCREEN_HEIGHT = 480
+
+
+class VisionFeatures:
+    """Encodes arrays of detected objects as (max_objects, nfeatures) tensors.
+
+    Objects are kept in the order the server sends them (pigs, birds,
+    blocks, TNTs, hills, sling); those past max_objects are dropped.
+
+    Args
+        max_objects -- number of rows of the tensor
+        width, height -- screen size the bounding boxes are divided by
+    """
+    def __init__(self, max_objects=32, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        self.max_objects = max_objects
+        type_ids = sorted(aibird_message.OBJECT_TYPES)
+        self.ntypes = len(type_ids)
+        self.nshapes = len(aibird_message.OBJECT_SHAPES)
+        self.nfeatures = self.ntypes + self.nshapes + 4
+        # Column of the one-hot type of every type ID
+        self._type_column = np.zeros(max(type_ids) + 1, dtype=np.intp)
+        self._type_column[type_ids] = np.arange(self.ntypes)
+        self._box_scale = np.array([width, height, width, height], dtype=np.float32)
+        self.observation_space = gym.spaces.Box(
+            low=0, high=np.inf, shape=(max_objects, self.nfeatures), dtype=np.float32)
+
+    def __call__(self, objects):
+        """Return the tensor of the (n, 6) array returned by AIBirdClient.vision."""
+        objects = objects[:self.max_objects]
+        rows = np.arange(len(objects))
+        features = np.zeros((self.max_objects, self.nfeatures), dtype=np.float32)
+        features[rows, self._type_column[objects[:, aibird_message.VISION_TYPE]]] = 1
+        features[rows, self.ntypes + objects[:, aibird_message.VISION_SHAPE]] = 1
+        features[rows, -4:] = objects[:, aibird_message.VISION_X:] / self._box_scale
+        return features
@@ -0,0 +1,76 @@
+"""Generalized advantage estimation for the PPO2 Runner
+
+All arrays are laid out (nsteps, nenvs) like the Runner's rollout, where
+dones[t] tells whether the observation of step t starts a new episode.
+"""
+import numpy as np
+
+
+def reverse_linear_scan(coefs, inputs):
+    """Solve x[t] = inputs[t] + coefs[t] * x[t+1] with x[nsteps] = 0 along axis 0.
+
+    Uses the doubling (Hillis-Steele) scan: after the pass with stride s, x[t]
+    holds the sum over the next 2s steps and a[t] the product of the next 2s
+    coefficients, so log2(nsteps) vectorized passes replace the Python loop.
+    """
+    x = np.array(inputs, dtype=np.float32)
+    a = np.array(coefs, dtype=np.float32)
+    shift = 1
+    nsteps = len(x)
+    while shift < nsteps:
+        x[:-shift] += a[:-shift] * x[shift:]
+        a[:-shift] = a[:-shift] * a[shift:]
+        shift *= 2
+    return x
+
+def gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """Return the advantages and the returns of a rollout.
+
+    last_values and last_dones describe the observation following the last
+    step and bootstrap the value of unfinished episodes.
+    """
+    nextnonterminal = 1.0 - np.concatenate([dones[1:], np.asarray(last_dones)[None]]).astype(np.float32)
+    nextvalues = np.concatenate([values[1:], np.asarray(last_values, np.float32)[None]])
+    deltas = rewards + gamma * nextvalues * nextnonterminal - values
+    advs = reverse_linear_scan(gamma * lam * nextnonterminal, deltas)
+    return advs, advs + values
+
+def gae_loop(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """Reference implementation of `gae`, the loop formerly in Runner.run."""
+    nsteps = len(rewards)
+    advs = np.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(nsteps)):
+        if t == nsteps - 1:
+            nextnonterminal = 1.0 - last_dones
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - dones[t+1]
+            nextvalues = values[t+1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advs[t] = lastgaelam = delta + gamma * lam * nextnonterminal * lastgaelam
+    return advs, advs + values
+
+def random_rollout(nsteps, nenvs, done_prob=0.2, seed=0):
+    """Return random (rewards, values, dones, last_values, last_dones) arrays."""
+    rng = np.random.RandomState(seed)
+    return (rng.randn(nsteps, nenvs).astype(np.float32),
+            rng.randn(nsteps, nenvs).astype(np.float32),
+            rng.rand(nsteps, nenvs) < done_prob,
+            rng.randn(nenvs).astype(np.float32),
+            rng.rand(nenvs) < done_prob)
+
+def test_gae():
+    for nsteps, nenvs in [(1, 1), (2, 3), (7, 1), (1024, 1), (1000, 8)]:
+        for done_prob in [0.0, 0.2, 1.0]:
+            for gamma, lam in [(1, 0.95), (0.99, 0.95), (0.99, 1)]:
+                rollout = random_rollout(nsteps, nenvs, done_prob)
+                expected = gae_loop(*rollout, gamma=gamma, lam=lam)
+                actual = gae(*rollout, gamma=gamma, lam=lam)
+                for exp, act in zip(expected, actual):
+                    assert act.shape == exp.shape and act.dtype == exp.dtype
+                    assert np.allclose(act, exp, rtol=1e-4, atol=1e-4), (nsteps, nenvs)
+    print('ok gae')
+
+if __name__ == '__main__':
+    test_gae()
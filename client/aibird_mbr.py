@@ -0,0 +1,471 @@
+"""NumPy port of the MBR vision of the AIBird server (ab.vision.VisionMBR)
+
+Finds the minimum bounding rectangles of the pigs, birds, blocks, TNTs and
+the slingshot in a full 840x480 RGB frame, such as the ones returned by
+AIBirdClient.screenshot and raw_screenshot (without roi, scale or grayscale).
+Running it on the training host lets a process pool share the work that the
+single-threaded server would otherwise do for every env.
+
+Like VisionMBR, colours are quantized to 3 bits per channel and the
+detectors look at segments, the 4-connected components of one colour. All the
+segments of the colours the detectors use are labelled by a single call to
+scipy.ndimage.label. The detectors then follow the Java rules,
+including the order in which segments are merged and java.awt.Rectangle's
+arithmetic, so the rectangles are the ones of VisionMBR.
+
+Unlike the server's vision message, hills are not detected and the sling is
+the one of VisionMBR.findSlingshotMBR, not of VisionRealShape.findSling.
+
+Example:
+    objects = find_objects(client.raw_screenshot)   # (n, 6) int32 like client.vision
+    with VisionPool(4) as pool:
+        batch = pool.map(frames)
+"""
+import multiprocessing
+
+import numpy as np
+from scipy import ndimage
+
+import aibird_message
+
+WIDTH = 840
+HEIGHT = 480
+MENU = (0, 0, 190, 55)     # Top left buttons, never a block
+REGION_THRESHOLD = 10       # Minimal area of a block
+
+TYPE_IDS = {name: type_id for type_id, name in aibird_message.OBJECT_TYPES.items()}
+
+SLING_COLOURS = [345, 418, 273, 281, 209, 346, 354, 282, 351]
+# Colours of the segments the pig, bird and TNT detectors merge or touch
+SEGMENT_COLOURS = [0, 64, 146, 165, 238, 250, 280, 344, 376, 385, 410, 416, 418, 488,
+                   490, 497, 501, 508, 510]
+
+
+def quantize(img):
+    """Return the 9-bit colour codes (rrrgggbbb) of an RGB image as int16."""
+    img = np.asarray(img)
+    red, green, blue = (img[..., channel].astype(np.int16) for channel in range(3))
+    return ((red & 0xe0) << 1) | ((green & 0xe0) >> 2) | (blue >> 5)
+
+def dilate(rect, dx, dy):
+    """VisionUtils.dialateRectangle of an (x, y, width, height) tuple or (n, 4) array."""
+    rect = np.asarray(rect)
+    return np.stack([rect[..., 0] - dx, rect[..., 1] - dy,
+                     rect[..., 2] + 2 * dx, rect[..., 3] + 2 * dy], axis=-1)
+
+def union(rect, other):
+    """Rectangle.add(Rectangle) of two rectangles with non-negative sizes."""
+    x, y = min(rect[0], other[0]), min(rect[1], other[1])
+    return (x, y, max(rect[0] + rect[2], other[0] + other[2]) - x,
+            max(rect[1] + rect[3], other[1] + other[3]) - y)
+
+def intersects(rect, boxes):
+    """Rectangle.intersects of `rect` with every row of the (n, 4) `boxes`."""
+    x, y, w, h = rect
+    if w <= 0 or h <= 0:
+        return np.zeros(len(boxes), dtype=bool)
+    bx, by, bw, bh = boxes.T
+    return (bw > 0) & (bh > 0) & (bx + bw > x) & (x + w > bx) & (by + bh > y) & (y + h > by)
+
+def crop(rect, width=WIDTH, height=HEIGHT):
+    """VisionUtils.cropBoundingBox: moves a negative corner to 0 but keeps its size."""
+    x, y, w, h = (int(value) for value in rect)
+    x, y = max(x, 0), max(y, 0)
+    return x, y, min(w, width - x), min(h, height - y)
+
+def contains(rect, other):
+    """Rectangle.contains(Rectangle) for a non-empty `other`."""
+    return (other[0] >= rect[0] and other[1] >= rect[1]
+            and other[0] + other[2] <= rect[0] + rect[2]
+            and other[1] + other[3] <= rect[1] + rect[3])
+
+def bounding_slices(mask):
+    """Return the (rows, columns) slices of the True pixels of `mask`, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+class Scene:
+    """The quantized colours of one frame and, on demand, its segments.
+
+    Segments are numbered like VisionUtils.findConnectedComponents, in the
+    raster order of their first pixel; their boxes follow findBoundingBoxes.
+    Only the segments of SEGMENT_COLOURS are labelled.
+    """
+    def __init__(self, img):
+        self.scene = quantize(img)
+        self.height, self.width = self.scene.shape
+        self._colour = None
+        self._boxes = None
+        self._selected = {}
+
+    def mask(self, colours):
+        """Boolean image of the pixels of any of `colours`."""
+        lut = np.zeros(512, dtype=bool)
+        lut[colours] = True
+        return lut[self.scene]
+
+    def _label(self):
+        """Label the segments of SEGMENT_COLOURS with a single ndimage.label
+        over the window holding them.
+
+        Pixels go to the even cells of a grid twice as large, and the odd cells
+        between two pixels are set when both have the same colour, so the
+        4-connected components of the grid are the segments. Components are
+        numbered in the raster order of their first cell, which is a pixel.
+        """
+        pixels = self.mask(SEGMENT_COLOURS)
+        window = bounding_slices(pixels)
+        if window is None:
+            self._colour = np.zeros(0, dtype=self.scene.dtype)
+            self._boxes = np.zeros((0, 4), dtype=np.intp)
+            return
+        scene, pixels = self.scene[window], pixels[window]
+        height, width = scene.shape
+        grid = np.zeros((2 * height - 1, 2 * width - 1), dtype=bool)
+        grid[::2, ::2] = pixels
+        grid[::2, 1::2] = pixels[:, :-1] & (scene[:, :-1] == scene[:, 1:])
+        grid[1::2, ::2] = pixels[:-1] & (scene[:-1] == scene[1:])
+        labels = np.ascontiguousarray(ndimage.label(grid)[0][::2, ::2])
+        # Labels first appear in increasing order, so a running maximum steps
+        # up at the first pixel of every segment
+        labelled = np.flatnonzero(labels)
+        values = labels.ravel()[labelled]
+        first = labelled[np.diff(np.maximum.accumulate(values), prepend=0) > 0]
+        slices = ndimage.find_objects(labels)
+        ymin = np.array([rows.start for rows, _ in slices], dtype=np.intp)
+        ymax = np.array([rows.stop for rows, _ in slices], dtype=np.intp) - 1
+        xmin = np.array([cols.start for _, cols in slices], dtype=np.intp)
+        xmax = np.array([cols.stop for _, cols in slices], dtype=np.intp) - 1
+        # Rectangle(x, y, 1, 1) at the first pixel grown by Rectangle.add
+        xfirst = first % width
+        self._colour = scene.ravel()[first]
+        self._boxes = np.stack([xmin + window[1].start, ymin + window[0].start,
+                                np.maximum(xmax, xfirst + 1) - xmin,
+                                np.maximum(ymax - ymin, 1)], axis=-1)
+
+    def segments(self, colours):
+        """Return the colours and (n, 4) boxes of the segments of `colours`,
+        a subset of SEGMENT_COLOURS, in the order of VisionMBR's segment numbers.
+        """
+        key = tuple(colours)
+        if key not in self._selected:
+            if self._colour is None:
+                self._label()
+            selected = np.isin(self._colour, colours)
+            self._selected[key] = self._colour[selected], self._boxes[selected]
+        return self._selected[key]
+
+    def histogram(self, rect):
+        """VisionMBR.histogram: the number of pixels of every colour in `rect`."""
+        x, y, w, h = rect
+        patch = self.scene[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)]
+        return np.bincount(patch.ravel(), minlength=512)
+
+    def regions(self, seed, colours):
+        """Boxes of the 4-connected regions of `colours` pixels holding a pixel of
+        `seed`, in the raster order of their first seed pixel.
+
+        These are the flood fills of findSlingshotMBR, findStonesMBR, findIceMBR
+        and findWoodMBR, which start from Rectangle(x, y, 0, 0) so that their
+        size is the pixel extent minus one.
+        """
+        pixels = self.mask(colours)
+        window = bounding_slices(pixels)
+        if window is None:
+            return []
+        labels, _ = ndimage.label(pixels[window])
+        seed_labels = labels[self.scene[window] == seed]
+        _, first = np.unique(seed_labels, return_index=True)
+        slices = ndimage.find_objects(labels)
+        top, left = window[0].start, window[1].start
+        boxes = []
+        for label in seed_labels[np.sort(first)]:
+            rows, cols = slices[label - 1]
+            boxes.append((left + cols.start, top + rows.start, cols.stop - 1 - cols.start,
+                          rows.stop - 1 - rows.start))
+        return boxes
+
+    def merge(self, seed, colours, seed_dilation, dilation, absorb=()):
+        """Group segments around every segment of colour `seed` like VisionMBR.
+
+        Every seed segment, unless it was merged before, grows its dilated
+        box `bounds` with the following segments of `colours` (which include
+        `seed`) whose dilated boxes intersect it, visited in segment order,
+        and grows `obj` with their boxes. Afterwards the following segments
+        of `absorb` that intersect `bounds` once dilated can no longer be seeds.
+
+        Returns the list of (obj, bounds) of the seeds.
+        """
+        colour, boxes = self.segments(colours)
+        dilated = dilation(boxes)
+        seed_dilated = seed_dilation(boxes)
+        absorbed = np.isin(colour, absorb)
+        ignore = np.zeros(len(colour), dtype=bool)
+        groups = []
+        for n in np.flatnonzero(colour == seed):
+            if ignore[n]:
+                continue
+            obj = tuple(boxes[n])
+            bounds = tuple(seed_dilated[n])
+            m = n + 1
+            while True:
+                hits = np.flatnonzero(intersects(bounds, dilated[m:]))
+                if not len(hits):
+                    break
+                m += hits[0]
+                bounds = union(bounds, dilated[m])
+                obj = union(obj, boxes[m])
+                ignore[m] = True
+                m += 1
+            if absorb:
+                ignore[n + 1:] |= absorbed[n + 1:] & intersects(bounds, dilated[n + 1:])
+            groups.append((obj, bounds))
+        return groups
+
+
+def _dilate_half(boxes):
+    return dilate(boxes, boxes[:, 2] // 2 + 1, boxes[:, 3] // 2 + 1)
+
+def _dilate_tall(dx):
+    return lambda boxes: dilate(boxes, dx, boxes[:, 3] // 2 + 1)
+
+def _dilate_2(boxes):
+    return dilate(boxes, 2, 2)
+
+def _touching(scene, bounds, colours):
+    """Boxes of the segments of `colours` intersecting `bounds`."""
+    _, boxes = scene.segments(colours)
+    return boxes[intersects(bounds, boxes)]
+
+def find_pigs(scene):
+    """findPigsMBR: merged colour 376 touching a colour 250 segment."""
+    pigs = []
+    for obj, bounds in scene.merge(376, [376], _dilate_half, _dilate_half):
+        if len(_touching(scene, bounds, [250])):
+            pigs.append(crop(dilate(obj, obj[2] // 2 + 1, obj[3] // 2 + 1)))
+    return pigs
+
+def _find_with(scene, groups, colours, min_width=0):
+    """Grow every group with the segments of `colours` touching its bounds and
+    keep it if there is at least one and it is wider than `min_width`.
+    """
+    birds = []
+    for obj, bounds in groups:
+        touching = _touching(scene, bounds, colours)
+        for box in touching:
+            obj = union(obj, box)
+        if len(touching) and obj[2] > min_width:
+            birds.append(crop(obj))
+    return birds
+
+def find_red_birds(scene):
+    """findRedBirdsMBRs: merged colour 385 touching colour 488 or 501."""
+    groups = scene.merge(385, [385], _dilate_tall(1), _dilate_tall(1))
+    return _find_with(scene, groups, [488, 501])
+
+def find_yellow_birds(scene):
+    """findYellowBirdsMBRs: merged colour 497 around colour 288."""
+    birds = []
+    for obj, _ in scene.merge(497, [497], _dilate_2, _dilate_2):
+        obj = crop(dilate(obj, 2, 2))
+        if scene.histogram(obj)[288] > 0:
+            birds.append(obj)
+    return birds
+
+def find_blue_birds(scene):
+    """findBlueBirdsMBRs: colour 238 merged with its neighbours, touching colour 488."""
+    groups = scene.merge(238, [238, 165, 280, 344, 488, 416], _dilate_tall(1), _dilate_tall(2),
+                         absorb=[238])
+    return _find_with(scene, groups, [488], min_width=3)
+
+def find_black_birds(scene):
+    """findBlackBirdsMBRs: colour 488 merged with 146, 64 and 0, mostly black."""
+    birds = []
+    for obj, _ in scene.merge(488, [488, 146, 64, 0], _dilate_2, _dilate_2):
+        obj = crop(dilate(obj, 2, 2))
+        hist = scene.histogram(obj)
+        if hist[0] > max(32, 0.1 * obj[2] * obj[3]) and hist[64] > 0 and hist[385] == 0:
+            birds.append(obj)
+    return birds
+
+def find_white_birds(scene):
+    """findWhiteBirdsMBRs: colour 490 merged with 508 and 510, within the play area."""
+    birds = []
+    for obj, _ in scene.merge(490, [490, 508, 510], _dilate_2, _dilate_2):
+        obj = crop(dilate(obj, 2, 2))
+        if obj[1] < 60 or obj[1] > 385:
+            continue
+        hist = scene.histogram(obj)
+        if hist[510] > 0 and hist[508] > 0:
+            birds.append(obj)
+    return birds
+
+def find_tnts(scene):
+    """findTNTsMBR: colour 410 merged with 418, around colours 457 and 511."""
+    tnts = []
+    for obj, _ in scene.merge(410, [410, 418], _dilate_2, _dilate_2):
+        obj = crop(dilate(obj, 2, 2))
+        hist = scene.histogram(obj)
+        if hist[457] > 0 and hist[511] > 0:
+            tnts.append(obj)
+    return tnts
+
+def _find_blocks(scene, seed, colours):
+    return [obj for obj in scene.regions(seed, colours)
+            if obj[2] * obj[3] > REGION_THRESHOLD and not contains(MENU, obj)]
+
+def find_stones(scene):
+    """findStonesMBR"""
+    return _find_blocks(scene, 365, [365])
+
+def find_wood(scene):
+    """findWoodMBR"""
+    return _find_blocks(scene, 481, [481, 408, 417])
+
+def find_ice(scene):
+    """findIceMBR"""
+    return _find_blocks(scene, 311, [311, 247, 183])
+
+def _column_count(scene, x, y, height, colour):
+    """Number of `colour` pixels of the column Rectangle(x, y, 1, height)."""
+    return scene.histogram((x, y, 1, height))[colour]
+
+def find_sling(scene):
+    """findSlingshotMBR: the first region around colour 345 that looks like a
+    sling once the shelf below it is cut off, or None.
+    """
+    for x, y, w, h in scene.regions(345, SLING_COLOURS):
+        hist = scene.histogram((x, y, w, h))
+        if h > 10:
+            count = _column_count(scene, x, y, h, 511)
+            if scene.scene[y, x] in (511, 447):
+                column = scene.scene[y:y + h, x]
+                rows = np.flatnonzero(np.isin(column, SLING_COLOURS))
+                if len(rows):
+                    h = int(rows[0])
+            # As in Java, the column after the first is checked next
+            while count >= h * 0.8:
+                x, w = x + 1, w - 1
+                count = _column_count(scene, x + 1, y, h, 511)
+            count = _column_count(scene, x + w, y, h, 511)
+            while count >= h * 0.8 and h > 10:
+                w -= 1
+                count = _column_count(scene, x + w, y, h, 511)
+        if w > h:
+            continue
+        if hist[345] > max(32, 0.1 * w * h) and hist[64] != 0:
+            return union((x, y, w, h), (x - w // 10, y - h // 3, w // 10 * 12, h // 3 * 4))
+    return None
+
+# Detectors in the order of the server's vision message
+DETECTORS = [
+    ('pig', find_pigs),
+    ('red bird', find_red_birds),
+    ('yellow bird', find_yellow_birds),
+    ('blue bird', find_blue_birds),
+    ('black bird', find_black_birds),
+    ('white bird', find_white_birds),
+    ('stone', find_stones),
+    ('wood', find_wood),
+    ('ice', find_ice),
+    ('TNT', find_tnts),
+]
+
+def find_objects(img):
+    """Return the objects of an RGB frame as the (n, 6) int32 array of
+    aibird_message.recv_vision_objects. Every shape is a rectangle.
+    """
+    scene = Scene(img)
+    rows = []
+    for name, detector in DETECTORS:
+        rows += [(TYPE_IDS[name], 0) + tuple(rect) for rect in detector(scene)]
+    sling = find_sling(scene)
+    if sling is not None:
+        rows.append((TYPE_IDS['sling'], 0) + tuple(sling))
+    return np.array(rows, dtype=np.int32).reshape(-1, 6)
+
+
+def paint(frame, rect, colour):
+    """Fill Rectangle `rect` of an RGB `frame` with a value quantized to `colour`."""
+    x, y, w, h = rect
+    frame[y:y + h, x:x + w] = ((colour >> 6) << 5, ((colour >> 3) & 7) << 5, (colour & 7) << 5)
+
+def synthetic_frame(level=0):
+    """Draw a deterministic scene in the game's colours for find_objects.
+
+    Every level has a sling holding a black shadow, a red bird with a 501
+    spot, a wood tower and 1 + level % 3 pigs with a 250 spot, shifted right
+    by 10 * (level % 5) pixels.
+    """
+    frame = np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    paint(frame, (0, 0, WIDTH, HEIGHT), 310)             # Sky
+    paint(frame, (190, 310, 10, 90), 345)                # Sling
+    paint(frame, (194, 350, 2, 2), 64)
+    paint(frame, (150, 380, 10, 10), 385)                # Red bird
+    paint(frame, (155, 384, 4, 4), 501)
+    left = 500 + 10 * (level % 5)
+    paint(frame, (left, 300, 20, 100), 481)              # Wood tower
+    for pig in range(1 + level % 3):
+        x = left + 100 + 40 * pig
+        paint(frame, (x, 380, 20, 20), 376)
+        paint(frame, (x + 5, 385, 4, 4), 250)
+    return frame
+
+def test_find_objects():
+    scene = Scene(synthetic_frame())
+    colour, boxes = scene.segments([250, 376, 385, 501])
+    # Raster order of the first pixels
+    assert colour.tolist() == [385, 376, 501, 250]
+    assert boxes.tolist() == [[150, 380, 9, 9], [600, 380, 19, 19],
+                              [155, 384, 3, 3], [605, 385, 3, 3]]
+    expected = [(TYPE_IDS['pig'], 0, 590, 370, 39, 39),
+                (TYPE_IDS['red bird'], 0, 150, 380, 9, 9),
+                (TYPE_IDS['wood'], 0, 500, 300, 19, 99),
+                (TYPE_IDS['sling'], 0, 190, 281, 9, 118)]
+    assert find_objects(synthetic_frame()).tolist() == [list(row) for row in expected]
+    assert np.array_equal(find_objects(np.zeros((HEIGHT, WIDTH, 3), np.uint8)), np.zeros((0, 6)))
+    counts = [np.bincount(find_objects(synthetic_frame(level))[:, 0], minlength=19)
+              for level in range(3)]
+    assert [count[TYPE_IDS['pig']] for count in counts] == [1, 2, 3]
+    print('ok mbr')
+
+
+class VisionPool:
+    """find_objects on a pool of worker processes.
+
+    Args
+        processes -- number of workers, all cores by default
+
+    Usage:
+        with VisionPool(4) as pool:
+            batch = pool.map(frames)        # list of (n, 6) arrays
+            pending = pool.submit(frame)    # pending.get() returns the objects
+    """
+    def __init__(self, processes=None):
+        self._pool = multiprocessing.Pool(processes)
+
+    def map(self, frames, chunksize=1):
+        """Return the objects of every frame of `frames`, in order."""
+        return self._pool.map(find_objects, frames, chunksize)
+
+    def submit(self, frame):
+        """Start finding the objects of `frame`; return a multiprocessing AsyncResult."""
+        return self._pool.apply_async(find_objects, (frame,))
+
+    def close(self):
+        """Stop the workers."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    test_find_objects()
@@ -6,12 +6,33 @@ Example:
     size, width, height = recv_screenshot_size(result)
     screenshot_raw = recv(size)
     screenshot = recv_screenshot(screenshot_raw, width, height)
+
+    send(get_raw_screenshot())      # Requests an uncompressed screenshot
+    header = recv(LEN_RAW_SCREENSHOT_HEADER)
+    width, height, channels, dtype = recv_raw_screenshot_header(header)
+    pixels = recv(width * height * channels)    # Row major, ready for np.frombuffer
+
+    send(get_delta_screenshot(tile))    # Requests the tiles changed since the last one
+    header = recv(LEN_DELTA_SCREENSHOT_HEADER)
+    width, height, channels, dtype, tile, count = recv_delta_screenshot_header(header)
+    indices = recv(4 * count)           # Row major tile indices, network order ints
+    tiles = recv(count * tile * tile * channels)
+
+    send(get_vision())                  # Requests the objects detected by the server
+    count = recv_vision_count(recv(LEN_VISION_COUNT))
+    objects = recv_vision_objects(recv(count * LEN_VISION_OBJECT))
 """
 import struct
 
+import numpy as np
+
 # Message IDs
 MID_SCREENSHOT = 11
 MID_GET_STATE = 12
+MID_SCREENSHOT_RAW = 14
+MID_SCREENSHOT_DELTA = 15
+MID_CONFIGURE_SCREENSHOT = 16
+MID_VISION = 17
 MID_GET_BEST_SCORE = 13
 MID_GET_MY_SCORE = 23
 MID_CART_SHOOT_SAFE = 31
@@ -22,18 +43,60 @@ MID_SEQ_SHOTS_SAFE = 33
 MID_SEQ_SHOTS_FAST = 43
 MID_FULL_ZOOM_OUT = 34
 MID_FULL_ZOOM_IN = 35
+MID_POLAR_STEP = 37
+MID_POLAR_STEP_DELTA = 38
+MID_POLAR_STEP_VISION = 39
 MID_CLICK_IN_CENTER = 36
 MID_LOAD_LEVEL = 51
 MID_RESTART_LEVEL = 52
+MID_READY = 61
 
 # Length of response messages
 LEN_SCREENSHOT = 4              # Size
+LEN_RAW_SCREENSHOT_HEADER = 16  # Width, height, channels, dtype
+LEN_DELTA_SCREENSHOT_HEADER = 24    # Raw screenshot header, tile size, number of tiles
 LEN_PIXEL = 3                   # RGB
 LEN_GET_STATE = 4
+LEN_READY = 4                   # State, only sent once the browser is connected
 LEN_GET_SCORE = 4          # Score for each Level = 4, 21 Levels
 LEN_GET_CURRENT_LEVEL = 4       # Current Level = 1
 LEN_ETC = 4                     # OK/ERR
-
+LEN_STEP = 12                   # Score delta, state, birds left (a raw screenshot follows)
+LEN_VISION_COUNT = 4            # Number of objects
+LEN_VISION_OBJECT = 24          # Type, shape, x, y, width, height
+
+# Columns of the objects returned by recv_vision_objects
+VISION_TYPE, VISION_SHAPE, VISION_X, VISION_Y, VISION_WIDTH, VISION_HEIGHT = range(6)
+
+# Object type IDs (ab.vision.ABType)
+OBJECT_TYPES = {
+    0: 'unknown',
+    1: 'ground',
+    2: 'hill',
+    3: 'sling',
+    4: 'red bird',
+    5: 'yellow bird',
+    6: 'blue bird',
+    7: 'black bird',
+    8: 'white bird',
+    9: 'pig',
+    10: 'ice',
+    11: 'wood',
+    12: 'stone',
+    18: 'TNT'
+}
+
+# Object shapes (ab.vision.ABShape)
+OBJECT_SHAPES = ['rect', 'poly', 'circle', 'triangle']
+
+# Color modes of raw and delta screenshots
+COLOR_RGB = 0
+COLOR_GRAY = 1
+
+# Element types of raw screenshots
+RAW_DTYPES = {
+    0: 'uint8'
+}
 
 
 class GameState:
@@ -71,6 +134,10 @@ class GameState:
     def __str__(self):
         return self.STATE_STR[self.state]
 
+    def isready(self):
+        """ Return true if the game has left the loading screens. """
+        return self.state != self.STATE_UNKNOWN and self.state != self.STATE_LOADING
+
     def isover(self):
         """ Return true if the level is over. Return false otherwise. """
         return self.state == self.STATE_WON or self.state == self.STATE_LOST
@@ -95,6 +162,77 @@ def recv_screenshot_size(result):
     return struct.unpack('!i', result)[0]
     # return width * height, width, height        # with * height RGB tuples
 
+def get_raw_screenshot():
+    """Formulate an uncompressed screenshot request message"""
+    return struct.pack('!b', MID_SCREENSHOT_RAW)
+
+def recv_raw_screenshot_header(result):
+    """Parse the header preceding the pixels of a raw screenshot.
+
+    Arguments
+    result -- received data
+
+    returns width, height, number of channels and the name of the element type
+    """
+    width, height, channels, dtype = struct.unpack('!iiii', result)
+    if dtype not in RAW_DTYPES:
+        raise ValueError('recv_raw_screenshot_header dtype = {}'.format(dtype))
+    return width, height, channels, RAW_DTYPES[dtype]
+
+def get_delta_screenshot(tile):
+    """Formulate a delta screenshot request message.
+
+    The server replies with the tile x tile tiles that changed since the last
+    delta screenshot it sent to this connection, or with every tile the first time.
+    """
+    return struct.pack('!bi', MID_SCREENSHOT_DELTA, tile)
+
+def recv_delta_screenshot_header(result):
+    """Parse the header preceding the tiles of a delta screenshot.
+
+    Arguments
+    result -- received data
+
+    returns width, height, number of channels, the name of the element type,
+    the tile size and the number of tiles that follow
+    """
+    width, height, channels, dtype, tile, count = struct.unpack('!iiiiii', result)
+    if tile <= 0:
+        # The server rejected the tile size of the request
+        raise ValueError('recv_delta_screenshot_header tile = {}'.format(tile))
+    if dtype not in RAW_DTYPES:
+        raise ValueError('recv_delta_screenshot_header dtype = {}'.format(dtype))
+    return width, height, channels, RAW_DTYPES[dtype], tile, count
+
+def configure_screenshot(left=0, top=0, width=0, height=0, scale=1, color=COLOR_RGB):
+    """Formulate a message registering how the server reduces screenshots.
+
+    Raw, delta and step screenshots that follow are cropped to the region
+    (a width or height of 0 extends it to the edge), then shrunk by the
+    integer `scale` averaging every scale x scale block, then converted to
+    `color`: COLOR_RGB or COLOR_GRAY (one channel). PNG screenshots are not affected.
+    The response is parsed by recv_result.
+    """
+    return struct.pack('!biiiiii', MID_CONFIGURE_SCREENSHOT, left, top, width, height,
+                       scale, color)
+
+def get_vision():
+    """Formulate a message requesting the objects the server detects in a screenshot"""
+    return struct.pack('!b', MID_VISION)
+
+def recv_vision_count(result):
+    """Parse the number of objects preceding the objects of a vision response."""
+    return struct.unpack('!i', result)[0]
+
+def recv_vision_objects(result):
+    """Parse the objects of a vision response.
+
+    Return a (number of objects, 6) int32 numpy array whose columns are the
+    type ID (see OBJECT_TYPES), the shape (see OBJECT_SHAPES) and the x, y,
+    width and height of the bounding box in screen pixels.
+    """
+    return np.frombuffer(result, '>i4').reshape(-1, 6).astype(np.int32)
+
 def recv_pixel(result):
     """Parse the stream into an image
 
@@ -117,6 +255,14 @@ def recv_state(result):
     """
     return GameState(struct.unpack('!i', result)[0])
 
+def get_ready():
+    """Formulate a readiness request message.
+
+    The server answers with the current state (see recv_state) once the
+    browser is connected to its proxy.
+    """
+    return struct.pack('!b', MID_READY)
+
 def get_my_score():
     """Formulate a message requesting my score"""
     return struct.pack('!b', MID_GET_MY_SCORE)
@@ -157,6 +303,47 @@ def polar_shoot(r, theta, tap_time, mode='safe'):
     tap_time = int(round(tap_time * 1000))      # Convert seconds to milliseconds
     return struct.pack('!biii', mid, r, theta, tap_time)
 
+def polar_step(r, theta, tap_time):
+    """Formulate a step request message.
+
+    The server zooms out, shoots like a safe polar shoot and replies with the
+    outcome followed by a raw screenshot.
+    """
+    r = int(round(r))
+    theta = int(round(theta * 100))
+    tap_time = int(round(tap_time * 1000))      # Convert seconds to milliseconds
+    return struct.pack('!biii', MID_POLAR_STEP, r, theta, tap_time)
+
+def polar_step_delta(r, theta, tap_time, tile):
+    """Formulate a step request message answered with a delta screenshot.
+
+    Like polar_step, but the screenshot following the outcome is a delta
+    screenshot (see get_delta_screenshot) with tiles of size `tile`.
+    """
+    r = int(round(r))
+    theta = int(round(theta * 100))
+    tap_time = int(round(tap_time * 1000))      # Convert seconds to milliseconds
+    return struct.pack('!biiii', MID_POLAR_STEP_DELTA, r, theta, tap_time, tile)
+
+def polar_step_vision(r, theta, tap_time):
+    """Formulate a step request message answered with the detected objects.
+
+    Like polar_step, but the outcome is followed by a vision response
+    (see get_vision) instead of a screenshot.
+    """
+    r = int(round(r))
+    theta = int(round(theta * 100))
+    tap_time = int(round(tap_time * 1000))      # Convert seconds to milliseconds
+    return struct.pack('!biii', MID_POLAR_STEP_VISION, r, theta, tap_time)
+
+def recv_step(result):
+    """Parse the fixed part of a response of a step request message
+
+    Return the score gained by the shot, a GameState object and the number of birds left.
+    """
+    reward, state, birds = struct.unpack('!iii', result)
+    return reward, GameState(state), birds
+
 def zoom_out():
     """Formulate a zoom out request message"""
     return struct.pack('!b', MID_FULL_ZOOM_OUT)
@@ -185,7 +372,7 @@ def recv_result(result):
 
     Available request messages:
     cart_shoot, polar_shoot, zoom_out, zoom_in, click_in_center,
-    load_level, restart_level
+    load_level, restart_level, configure_screenshot
 
     Return True when succeeded, False otherwise
     """
@@ -0,0 +1,333 @@
+"""A pure Python stand-in for the AIBird server
+
+It speaks the same protocol as server/src/ab/AIBirdProtocol.java but plays a
+deterministic toy game instead of driving chrome, so that the client, the
+environments and the benchmarks can run on machines without a browser.
+
+Usage:
+    python aibird_mock_server.py [--port PORT] [--frames FRAMES.npy] [--latency SECONDS]
+
+    server = MockServer(port=0, latency={aibird_message.MID_POLAR_STEP: 0.5})
+    server.start()                      # Serves in a background thread
+    client = aibird_client.AIBirdClient(port=server.port)
+"""
+import argparse
+import base64
+import io
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import aibird_message
+import aibird_preprocess
+from aibird_message import GameState
+from aibird_reader import FramedReader
+
+NUMBER_OF_BIRDS = [3, 5, 4, 4, 4, 4, 4, 4, 4, 5, 4, 4, 4, 4, 4, 5, 3, 5, 4, 5, 8]
+WIDTH = 840
+HEIGHT = 480
+KILL_SCORE = 5000       # A shot scoring at least this kills a pig
+REJECTED_DELTA = bytes(24)  # Delta header replied to a tile size that is not positive
+
+# Number of ints following each message ID
+ARGS = {
+    aibird_message.MID_SCREENSHOT: 0,
+    aibird_message.MID_SCREENSHOT_RAW: 0,
+    aibird_message.MID_SCREENSHOT_DELTA: 1,
+    aibird_message.MID_CONFIGURE_SCREENSHOT: 6,
+    aibird_message.MID_VISION: 0,
+    aibird_message.MID_GET_STATE: 0,
+    aibird_message.MID_GET_MY_SCORE: 0,
+    aibird_message.MID_CART_SHOOT_SAFE: 3,
+    aibird_message.MID_CART_SHOOT_FAST: 3,
+    aibird_message.MID_POLAR_SHOOT_SAFE: 3,
+    aibird_message.MID_POLAR_SHOOT_FAST: 3,
+    aibird_message.MID_FULL_ZOOM_OUT: 0,
+    aibird_message.MID_FULL_ZOOM_IN: 0,
+    aibird_message.MID_POLAR_STEP: 3,
+    aibird_message.MID_POLAR_STEP_DELTA: 4,
+    aibird_message.MID_POLAR_STEP_VISION: 3,
+    aibird_message.MID_LOAD_LEVEL: 1,
+    aibird_message.MID_RESTART_LEVEL: 0,
+    aibird_message.MID_READY: 0,
+}
+
+
+def pack_int(value):
+    return struct.pack('!i', value)
+
+
+class MockGame:
+    """Deterministic toy version of the game behind one client connection.
+
+    Level `n` has 2 + n % 3 pigs and NUMBER_OF_BIRDS[n - 1] birds. The score of
+    a shot only depends on the level, the number of shots so far and the shot
+    itself; a shot scoring at least KILL_SCORE kills a pig. The level is won
+    once every pig is dead and lost once the birds run out.
+
+    Args
+        frames -- optional array of recorded screenshots, (N, height, width, 3)
+                  uint8. Shot `k` of level `n` shows frames[(21 * k + n) % N].
+                  Synthetic frames are drawn when it is None.
+    """
+    def __init__(self, frames=None):
+        self.frames = frames
+        self.level = 1
+        self.score = 0
+        self.actions = 0
+        self.pigs = 0
+        self.state = GameState.STATE_LEVEL_SELECTION
+        self._delta = None      # Padded frame last sent by a delta screenshot
+        self._delta_tile = 0
+        self.roi = (0, 0, 0, 0)     # Registered by configure_screenshot
+        self.scale = 1
+        self.color = aibird_message.COLOR_RGB
+        self._handlers = {
+            aibird_message.MID_SCREENSHOT: self.screenshot,
+            aibird_message.MID_SCREENSHOT_RAW: self.raw_screenshot,
+            aibird_message.MID_SCREENSHOT_DELTA: self.delta_screenshot,
+            aibird_message.MID_CONFIGURE_SCREENSHOT: self.configure_screenshot,
+            aibird_message.MID_VISION: self.vision,
+            aibird_message.MID_GET_STATE: lambda: pack_int(self.state),
+            aibird_message.MID_GET_MY_SCORE: lambda: pack_int(self.score),
+            aibird_message.MID_CART_SHOOT_SAFE: self.shoot,
+            aibird_message.MID_CART_SHOOT_FAST: self.shoot,
+            aibird_message.MID_POLAR_SHOOT_SAFE: self.shoot,
+            aibird_message.MID_POLAR_SHOOT_FAST: self.shoot,
+            aibird_message.MID_FULL_ZOOM_OUT: lambda: pack_int(1),
+            aibird_message.MID_FULL_ZOOM_IN: lambda: pack_int(1),
+            aibird_message.MID_POLAR_STEP: self.step,
+            aibird_message.MID_POLAR_STEP_DELTA: self.step_delta,
+            aibird_message.MID_POLAR_STEP_VISION: self.step_vision,
+            aibird_message.MID_LOAD_LEVEL: self.load_level,
+            aibird_message.MID_RESTART_LEVEL: lambda: self.load_level(self.level),
+            aibird_message.MID_READY: lambda: pack_int(self.state),
+        }
+
+    def handle(self, mid, args):
+        """Return the response to message `mid` with int arguments `args`."""
+        return self._handlers[mid](*args)
+
+    def load_level(self, level):
+        self.level = level
+        self.score = 0
+        self.actions = 0
+        self.pigs = 2 + level % 3
+        self.state = GameState.STATE_PLAYING
+        return pack_int(1)
+
+    def _play(self, first, second, tap_time):
+        """Apply one shot and return the score it gained."""
+        if self.state != GameState.STATE_PLAYING:
+            return 0
+        self.actions += 1
+        gain = (first * 31 + second * 17 + tap_time * 7
+                + self.level * 101 + self.actions * 13) % 100 * 100
+        if gain >= KILL_SCORE:
+            self.pigs -= 1
+        self.score += gain
+        if self.pigs == 0:
+            self.state = GameState.STATE_WON
+        elif self.actions >= NUMBER_OF_BIRDS[self.level - 1]:
+            self.state = GameState.STATE_LOST
+        return gain
+
+    def shoot(self, first, second, tap_time):
+        self._play(first, second, tap_time)
+        return pack_int(1)
+
+    def step(self, r, theta, tap_time, tile=0):
+        gain = self._play(r, theta, tap_time)
+        birds = max(0, NUMBER_OF_BIRDS[self.level - 1] - self.actions)
+        screenshot = self.delta_screenshot(tile) if tile > 0 else self.raw_screenshot()
+        return struct.pack('!iii', gain, self.state, birds) + screenshot
+
+    def step_delta(self, r, theta, tap_time, tile):
+        if tile <= 0:
+            # Like the server, do not shoot and reply an empty delta header
+            birds = max(0, NUMBER_OF_BIRDS[self.level - 1] - self.actions)
+            return struct.pack('!iii', 0, self.state, birds) + REJECTED_DELTA
+        return self.step(r, theta, tap_time, tile)
+
+    def step_vision(self, r, theta, tap_time):
+        gain = self._play(r, theta, tap_time)
+        birds = max(0, NUMBER_OF_BIRDS[self.level - 1] - self.actions)
+        return struct.pack('!iii', gain, self.state, birds) + self.vision()
+
+    def vision(self):
+        """Encode the objects of the synthetic scene, see synthetic_objects."""
+        birds = max(0, NUMBER_OF_BIRDS[self.level - 1] - self.actions)
+        objects = synthetic_objects(self.level, self.pigs, self.actions, birds)
+        return pack_int(len(objects)) + objects.astype('>i4').tobytes()
+
+    def frame(self):
+        """Return the current screenshot as an (height, width, 3) uint8 array."""
+        if self.frames is not None:
+            return self.frames[(21 * self.actions + self.level) % len(self.frames)]
+        return synthetic_frame(self.level, self.pigs, self.actions)
+
+    def configure_screenshot(self, left, top, width, height, scale, color):
+        if min(left, top, width, height) < 0 or scale < 1 or color not in (
+                aibird_message.COLOR_RGB, aibird_message.COLOR_GRAY):
+            return pack_int(0)
+        # Like the server, reject a region that reduces to an empty image
+        frame_height, frame_width = self.frame().shape[:2]
+        cropped_width = min(width or frame_width, frame_width - min(left, frame_width - 1))
+        cropped_height = min(height or frame_height, frame_height - min(top, frame_height - 1))
+        if cropped_width // scale == 0 or cropped_height // scale == 0:
+            return pack_int(0)
+        self.roi, self.scale, self.color = (left, top, width, height), scale, color
+        self._delta = None
+        return pack_int(1)
+
+    def reduced_frame(self):
+        """Return the current screenshot reduced as registered by configure_screenshot."""
+        frame = self.frame()
+        left, top, width, height = self.roi
+        left, top = min(left, frame.shape[1] - 1), min(top, frame.shape[0] - 1)
+        frame = frame[top:top + height if height else None, left:left + width if width else None]
+        if self.scale > 1:
+            frame = aibird_preprocess.downsample(frame, self.scale)
+        if self.color == aibird_message.COLOR_GRAY:
+            frame = aibird_preprocess.grayscale(frame)
+        return frame
+
+    def screenshot(self):
+        png = io.BytesIO()
+        Image.fromarray(self.frame()).save(png, format='png')
+        encoded = base64.b64encode(png.getvalue())
+        return pack_int(len(encoded)) + encoded
+
+    def raw_screenshot(self):
+        frame = np.ascontiguousarray(self.reduced_frame(), dtype=np.uint8)
+        height, width, channels = frame.shape
+        return struct.pack('!iiii', width, height, channels, 0) + frame.tobytes()
+
+
+    def delta_screenshot(self, tile):
+        """Encode the tiles that changed since the last delta screenshot."""
+        if tile <= 0:
+            return REJECTED_DELTA
+        frame = np.asarray(self.reduced_frame(), dtype=np.uint8)
+        height, width, channels = frame.shape
+        tiles_y, tiles_x = -(-height // tile), -(-width // tile)
+        padded = np.zeros((tiles_y * tile, tiles_x * tile, channels), dtype=np.uint8)
+        padded[:height, :width] = frame
+        grid = padded.reshape(tiles_y, tile, tiles_x, tile, channels).swapaxes(1, 2)
+        if self._delta is None or self._delta.shape != padded.shape or self._delta_tile != tile:
+            changed = np.ones((tiles_y, tiles_x), dtype=bool)
+        else:
+            last = self._delta.reshape(tiles_y, tile, tiles_x, tile, channels).swapaxes(1, 2)
+            changed = (grid != last).any(axis=(2, 3, 4))
+        self._delta, self._delta_tile = padded, tile
+        indices = np.flatnonzero(changed).astype('>i4')
+        return (struct.pack('!iiiiii', width, height, channels, 0, tile, len(indices))
+                + indices.tobytes() + grid[changed].tobytes())
+
+
+_SYNTHETIC = {}
+
+def synthetic_frame(level, pigs, actions):
+    """Draw a deterministic scene: sky, ground, a sling, a tower and the pigs left."""
+    key = (level, pigs, actions)
+    if key not in _SYNTHETIC:
+        frame = np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        frame[:] = (148, 206, 222)                          # Sky
+        frame[400:] = (64, 128, 32)                         # Ground
+        frame[310:400, 190:200] = (90, 50, 20)              # Sling
+        left = 500 + 10 * (level % 5)
+        frame[300 - 10 * actions:400, left:left + 20] = (200, 150, 60)     # Tower
+        for pig in range(pigs):
+            x = left + 40 + 30 * pig
+            frame[380:400, x:x + 20] = (100, 220, 60)
+        _SYNTHETIC[key] = frame
+    return _SYNTHETIC[key]
+
+
+def synthetic_objects(level, pigs, actions, birds):
+    """Return the objects of the scene drawn by synthetic_frame as the (n, 6)
+    array of aibird_message.recv_vision_objects: the pigs, the birds waiting
+    left of the sling, the tower and the sling.
+    """
+    left = 500 + 10 * (level % 5)
+    objects = [(9, 2, left + 40 + 30 * pig, 380, 20, 20) for pig in range(pigs)]
+    objects += [(4, 2, 170 - 20 * bird, 388, 12, 12) for bird in range(birds)]
+    objects.append((11, 0, left, 300 - 10 * actions, 20, 100 + 10 * actions))
+    objects.append((3, 0, 190, 310, 10, 90))
+    return np.array(objects, dtype=np.int32)
+
+
+class MockHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection with a fresh MockGame."""
+    def handle(self):
+        game = MockGame(self.server.frames)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = FramedReader(self.request)
+        while True:
+            try:
+                mid = struct.unpack('!b', reader.read(1))[0]
+                nargs = ARGS[mid]
+                args = struct.unpack('!{}i'.format(nargs), reader.read(4 * nargs))
+            except ConnectionError:
+                return
+            delay = self.server.latency.get(mid, self.server.default_latency)
+            if delay:
+                time.sleep(delay)
+            self.request.sendall(game.handle(mid, args))
+
+
+class MockServer(socketserver.ThreadingTCPServer):
+    """Mock AIBird server listening on `port` (0 picks a free one).
+
+    Args
+        frames -- recorded screenshots, see MockGame
+        latency -- dict from message ID to seconds to wait before replying
+        default_latency -- seconds to wait before replying to the other messages
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=2004, frames=None, latency=None,
+                 default_latency=0):
+        super().__init__((host, port), MockHandler)
+        self.frames = frames
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """ Run a mock server in the foreground """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=2004)
+    parser.add_argument('--frames', help='.npy file of recorded screenshots')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before every reply')
+    args = parser.parse_args()
+    frames = None if args.frames is None else np.load(args.frames, mmap_mode='r')
+    server = MockServer(args.host, args.port, frames, default_latency=args.latency)
+    print('Mock AIBird server listening on port', server.port, flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
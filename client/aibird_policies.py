@@ -6,7 +6,7 @@ from baselines.common.input import observation_input
 
 def nature_cnn(unscaled_images, **conv_kwargs):
     """
-    CNN from Nature paper.
+    CNN from Nature paper. Takes uint8 images and scales them to [0, 1] itself.
     """
     scaled_images = tf.cast(unscaled_images, tf.float32) / 255.
     activ = tf.nn.relu
@@ -17,11 +17,25 @@ def nature_cnn(unscaled_images, **conv_kwargs):
     h3 = conv_to_fc(h3)
     return activ(fc(h3, 'fc1', nh=512, init_scale=np.sqrt(2)))
 
+def policy_input(ob_space, nbatch, observ_placeholder=None):
+    """
+    Like observation_input, but may take the observations from an existing
+    tensor of a Box space (e.g. a minibatch of aibird_ppo2.MinibatchPipeline)
+    """
+    if observ_placeholder is None:
+        return observation_input(ob_space, nbatch)
+    return observ_placeholder, tf.to_float(observ_placeholder)
+
 class CnnPolicy(object):
+    """
+    Acts by sampling from pd, or with its mode while greedy is set (or when
+    step is called with greedy=True), e.g. for evaluation episodes; both act
+    ops share the network, so switching needs no new graph or weights.
+    """
 
-    def __init__(self, sess, ob_space, ac_space, nbatch, nsteps, reuse=False, **conv_kwargs): #pylint: disable=W0613
+    def __init__(self, sess, ob_space, ac_space, nbatch, nsteps, reuse=False, observ_placeholder=None, **conv_kwargs): #pylint: disable=W0613
         self.pdtype = make_pdtype(ac_space)
-        X, processed_x = observation_input(ob_space, nbatch)
+        X, processed_x = policy_input(ob_space, nbatch, observ_placeholder)
         with tf.variable_scope("model", reuse=reuse):
             h = nature_cnn(processed_x, **conv_kwargs)
             vf = fc(h, 'v', 1)[:,0]
@@ -29,42 +43,34 @@ class CnnPolicy(object):
 
         a0 = self.pd.sample()
         neglogp0 = self.pd.neglogp(a0)
+        greedy_a0 = self.pd.mode()
+        greedy_neglogp0 = self.pd.neglogp(greedy_a0)
         self.initial_state = None
+        self.greedy = False
+        # Callables are made on first use, as the train model never acts
+        callables = {}
 
-        def step(ob, *_args, **_kwargs):
-            a, v, neglogp = sess.run([a0, vf, neglogp0], {X:ob})
-            return a, v, self.initial_state, neglogp
-
-        def value(ob, *_args, **_kwargs):
-            return sess.run(vf, {X:ob})
-
-        self.X = X
-        self.vf = vf
-        self.step = step
-        self.value = value
-
-class CnnPolicyTest(object):
-
-    def __init__(self, sess, ob_space, ac_space, nbatch, nsteps, reuse=False, **conv_kwargs): #pylint: disable=W0613
-        self.pdtype = make_pdtype(ac_space, True)
-        X, processed_x = observation_input(ob_space, nbatch)
-        with tf.variable_scope("model", reuse=reuse):
-            h = nature_cnn(processed_x, **conv_kwargs)
-            vf = fc(h, 'v', 1)[:,0]
-            self.pd, self.pi = self.pdtype.pdfromlatent(h, init_scale=0.01)
-
-        a0 = self.pd.sample()
-        neglogp0 = self.pd.neglogp(a0)
-        self.initial_state = None
+        def act(ob, greedy):
+            if greedy not in callables:
+                fetches = [greedy_a0, vf, greedy_neglogp0] if greedy else [a0, vf, neglogp0]
+                callables[greedy] = sess.make_callable(fetches, [X])
+            return callables[greedy](ob)
 
-        def step(ob, *_args, **_kwargs):
-            a, v, neglogp = sess.run([a0, vf, neglogp0], {X:ob})
+        def step(ob, *_args, greedy=None, **_kwargs):
+            a, v, neglogp = act(ob, self.greedy if greedy is None else greedy)
             return a, v, self.initial_state, neglogp
 
         def value(ob, *_args, **_kwargs):
-            return sess.run(vf, {X:ob})
+            if 'value' not in callables:
+                callables['value'] = sess.make_callable(vf, [X])
+            return callables['value'](ob)
 
         self.X = X
         self.vf = vf
+        self.a0 = a0
+        self.neglogp0 = neglogp0
+        self.greedy_a0 = greedy_a0
+        self.greedy_neglogp0 = greedy_neglogp0
         self.step = step
         self.value = value
+
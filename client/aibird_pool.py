@@ -0,0 +1,145 @@
+""" A pool of pre-launched chrome and server pairs """
+import queue
+import threading
+import time
+
+import aibird_client
+from aibird_env import STARTUP_TIMEOUT, build_server, prepare_env, safe_terminate
+
+MAX_LAUNCH_FAILURES = 5     # Consecutive failed launches before the pool gives up
+LAUNCH_BACKOFF = 1          # Seconds before relaunching after a failure, doubled on each one
+
+
+class Instance:
+    """ A running chrome and server pair.
+
+    Attributes
+        chrome, server (psutil.Process): the processes
+        chrome_user (int): chrome profile number, which also sets the proxy port
+        client_port (int): port the server listens on
+    """
+    def __init__(self, chrome, server, chrome_user, client_port):
+        self.chrome = chrome
+        self.server = server
+        self.chrome_user = chrome_user
+        self.client_port = client_port
+
+    def terminate(self):
+        """ Terminate chrome and server. """
+        safe_terminate(self.chrome)
+        safe_terminate(self.server)
+
+
+class InstancePool:
+    """Keeps `size` chrome and server pairs warm so that a restart does not
+    have to wait for a launch.
+
+    Every pair needs its own chrome profile and ports, so `slots` must hold
+    at least `size` plus the number of instances in use at once. A failed
+    launch is retried with exponential backoff; after MAX_LAUNCH_FAILURES
+    failures in a row, acquire raises the last launch error.
+
+    Args
+        server_path -- directory of the server
+        slots -- list of (chrome_user, client_port) the pool may launch on
+        size -- number of standby instances
+
+    Usage:
+        pool = InstancePool(server_path, [(1, 2000), (2, 2001), (3, 2002)], size=1)
+        env.startup_from_pool(pool)
+    """
+    def __init__(self, server_path, slots, size=1):
+        assert len(slots) > size, 'InstancePool needs more slots than standby instances'
+        self.server_path = server_path
+        self.size = size
+        self._free = list(slots)
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._launching = 0
+        self._failures = 0
+        self._error = None
+        self._closed = False
+        build_server(server_path)
+        self._fill()
+
+    def _fill(self):
+        """ Launch instances in the background until `size` are ready or launching. """
+        with self._lock:
+            while (not self._closed and self._error is None and self._free
+                   and self._ready.qsize() + self._launching < self.size):
+                slot = self._free.pop(0)
+                self._launching += 1
+                threading.Thread(target=self._launch, args=slot, daemon=True).start()
+
+    def _launch(self, chrome_user, client_port):
+        chrome = server = None
+        try:
+            chrome, server = prepare_env(self.server_path, chrome_user, client_port)
+            # Hold the instance back until the browser has connected
+            probe = aibird_client.AIBirdClient(port=client_port)
+            probe.wait_ready(STARTUP_TIMEOUT)
+            probe.disconnect()
+        except Exception as exception: #pylint: disable=W0703
+            if chrome is not None:
+                Instance(chrome, server, chrome_user, client_port).terminate()
+            print('Failed to launch instance', chrome_user, client_port, exception, flush=True)
+            with self._lock:
+                self._failures += 1
+                failures = self._failures
+            if failures >= MAX_LAUNCH_FAILURES:
+                with self._lock:
+                    self._launching -= 1
+                    self._free.append((chrome_user, client_port))
+                    self._error = exception
+                # Wake up the acquire calls instead of leaving them blocked
+                self._ready.put(exception)
+                return
+            time.sleep(LAUNCH_BACKOFF * 2 ** (failures - 1))
+            with self._lock:
+                self._launching -= 1
+                self._free.append((chrome_user, client_port))
+            self._fill()
+            return
+        instance = Instance(chrome, server, chrome_user, client_port)
+        with self._lock:
+            self._launching -= 1
+            self._failures = 0
+            if not self._closed:
+                self._ready.put(instance)
+                return
+        instance.terminate()
+
+    def acquire(self, timeout=None):
+        """ Take a ready instance, waiting for one if necessary, and launch its
+        replacement in the background.
+
+        Raises the last launch error once the pool has given up launching.
+        """
+        instance = self._ready.get(timeout=timeout)
+        if isinstance(instance, Exception):
+            # Leave it for the other waiters
+            self._ready.put(instance)
+            raise instance
+        self._fill()
+        return instance
+
+    def release(self, instance):
+        """ Terminate `instance` in the background and make its slot reusable. """
+        def terminate():
+            instance.terminate()
+            with self._lock:
+                self._free.append((instance.chrome_user, instance.client_port))
+            self._fill()
+        threading.Thread(target=terminate, daemon=True).start()
+
+    def close(self):
+        """ Terminate the standby instances. Instances in use are left alone. """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                instance = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(instance, Instance):
+                instance.terminate()
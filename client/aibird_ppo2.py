@@ -1,6 +1,7 @@
 import os
 import time
-import joblib
+import queue
+import threading
 import numpy as np
 import os.path as osp
 import tensorflow as tf
@@ -8,20 +9,78 @@ from baselines import logger
 from collections import deque
 from baselines.common import explained_variance
 from baselines.common.runners import AbstractEnvRunner
+from aibird_gae import gae
+from aibird_checkpoint import Checkpointer, vec_normalize_arrays
+
+def _frozen_getter(getter, *args, **kwargs):
+    # Variables of the snapshot policy are only written by Model.sync_snapshot
+    kwargs['trainable'] = False
+    return getter(*args, **kwargs)
+
+class MinibatchPipeline(object):
+    """
+    Input pipeline of Model.train_next: upload feeds a whole rollout to the
+    initializer of a tf.data iterator once per update, then every get_next
+    gathers a shuffled minibatch of it in-graph while the previous one trains.
+    Every epoch visits the rollout in a new random order, like learn does.
+    """
+    def __init__(self, ob_space, pdtype, nbatch, nbatch_train):
+        assert nbatch % nbatch_train == 0
+        self._rollout = [
+            tf.placeholder(ob_space.dtype, (nbatch,) + ob_space.shape),       # obs
+            tf.placeholder(tf.float32, [nbatch]),                             # returns
+            pdtype.sample_placeholder([nbatch]),                              # actions
+            tf.placeholder(tf.float32, [nbatch]),                             # values
+            tf.placeholder(tf.float32, [nbatch]),                             # neglogpacs
+        ]
+        self._nepochs = tf.placeholder(tf.int64, [])
+        dataset = (tf.data.Dataset.range(nbatch)
+                   .shuffle(nbatch)
+                   .repeat(self._nepochs)
+                   .batch(nbatch_train)
+                   .map(lambda inds: tuple(tf.gather(arr, inds) for arr in self._rollout))
+                   .prefetch(1))
+        self._iterator = dataset.make_initializable_iterator()
+        self.obs, self.returns, self.actions, self.values, self.neglogpacs = self._iterator.get_next()
+
+    def upload(self, sess, nepochs, obs, returns, actions, values, neglogpacs):
+        """
+        Serve nepochs epochs of minibatches of this rollout
+        """
+        feed = dict(zip(self._rollout, (obs, returns, actions, values, neglogpacs)))
+        feed[self._nepochs] = nepochs
+        sess.run(self._iterator.initializer, feed)
 
 class Model(object):
     def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
-                nsteps, ent_coef, vf_coef, max_grad_norm):
+                nsteps, ent_coef, vf_coef, max_grad_norm, snapshot=False, pipeline=False,
+                keep_checkpoints=5):
         sess = tf.get_default_session()
 
         act_model = policy(sess, ob_space, ac_space, nbatch_act, 1, reuse=False)
-        train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True)
+        if pipeline:
+            # Minibatches come from the graph (see MinibatchPipeline) instead of feed_dict
+            mb = MinibatchPipeline(ob_space, act_model.pdtype, nbatch_act * nsteps, nbatch_train)
+            train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True,
+                                 observ_placeholder=mb.obs)
+        else:
+            train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True)
+        if snapshot:
+            # Copy of act_model with its own weights, for acting while training
+            with tf.variable_scope('snapshot', custom_getter=_frozen_getter):
+                snapshot_model = policy(sess, ob_space, ac_space, nbatch_act, 1, reuse=False)
 
-        A = train_model.pdtype.sample_placeholder([None])
-        ADV = tf.placeholder(tf.float32, [None])
-        R = tf.placeholder(tf.float32, [None])
-        OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
-        OLDVPRED = tf.placeholder(tf.float32, [None])
+        if pipeline:
+            A, R, OLDNEGLOGPAC, OLDVPRED = mb.actions, mb.returns, mb.neglogpacs, mb.values
+            advs = R - OLDVPRED
+            adv_mean, adv_var = tf.nn.moments(advs, axes=[0])
+            ADV = (advs - adv_mean) / (tf.sqrt(adv_var) + 1e-8)
+        else:
+            A = train_model.pdtype.sample_placeholder([None])
+            ADV = tf.placeholder(tf.float32, [None])
+            R = tf.placeholder(tf.float32, [None])
+            OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
+            OLDVPRED = tf.placeholder(tf.float32, [None])
         LR = tf.placeholder(tf.float32, [])
         CLIPRANGE = tf.placeholder(tf.float32, [])
 
@@ -48,6 +107,14 @@ class Model(object):
         grads = list(zip(grads, params))
         trainer = tf.train.AdamOptimizer(learning_rate=LR, epsilon=1e-5)
         _train = trainer.apply_gradients(grads)
+        if snapshot:
+            snapshot_vars = {v.name[len('snapshot/'):]: v for v in tf.global_variables('snapshot/')}
+            _sync = tf.group(*[snapshot_vars[p.name].assign(p) for p in params])
+
+        # Serializes the weight updates with the snapshot copies
+        self.lock = threading.Lock()
+        # Number of train calls so far, the version of the weights
+        self.train_steps = 0
 
         def train(lr, cliprange, obs, returns, masks, actions, values, neglogpacs, states=None):
             advs = returns - values
@@ -57,25 +124,63 @@ class Model(object):
             if states is not None:
                 td_map[train_model.S] = states
                 td_map[train_model.M] = masks
-            return sess.run(
-                [pg_loss, vf_loss, entropy, approxkl, clipfrac, _train],
-                td_map
-            )[:-1]
+            with self.lock:
+                self.train_steps += 1
+                return sess.run(
+                    [pg_loss, vf_loss, entropy, approxkl, clipfrac, _train],
+                    td_map
+                )[:-1]
+
+        def upload(nepochs, obs, returns, masks, actions, values, neglogpacs): #pylint: disable=W0613
+            """
+            Hand a rollout to the pipeline for the next nepochs * nminibatches train_next calls
+            """
+            mb.upload(sess, nepochs, obs, returns, actions, values, neglogpacs)
+
+        def train_next(lr, cliprange):
+            """
+            train on the next minibatch of the uploaded rollout
+            """
+            with self.lock:
+                self.train_steps += 1
+                return sess.run(
+                    [pg_loss, vf_loss, entropy, approxkl, clipfrac, _train],
+                    {LR:lr, CLIPRANGE:cliprange}
+                )[:-1]
         self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
 
-        def save(save_path):
-            ps = sess.run(params)
-            joblib.dump(ps, save_path)
+        # The Adam slots and beta powers are saved too, so a resumed run keeps its moments
+        checkpointer = Checkpointer(sess, params + trainer.variables(), keep=keep_checkpoints)
 
-        def load(load_path):
-            loaded_params = joblib.load(load_path)
-            restores = []
-            for p, loaded_p in zip(params, loaded_params):
-                restores.append(p.assign(loaded_p))
-            sess.run(restores)
-            # If you want to load weights, also save/load observation scaling inside VecNormalize
+        def save(save_path, env=None, update=None, vec_normalize=None):
+            """
+            Save the weights, the optimizer state, the VecNormalize statistics
+            of env (or vec_normalize, see Checkpointer.save) and the number of
+            updates; the file is written in the background (see wait_saves)
+            """
+            with self.lock:
+                checkpointer.save(save_path, env, update, vec_normalize)
 
-        self.train = train
+        def load(load_path, env=None):
+            """
+            Restore a checkpoint and return the number of updates saved with it, or None
+            """
+            with self.lock:
+                return checkpointer.load(load_path, env)
+
+        def sync_snapshot():
+            """
+            Copy the current weights to the snapshot policy and return their version
+            """
+            with self.lock:
+                sess.run(_sync)
+                return self.train_steps
+
+        if pipeline:
+            self.upload = upload
+            self.train_next = train_next
+        else:
+            self.train = train
         self.train_model = train_model
         self.act_model = act_model
         self.step = act_model.step
@@ -83,56 +188,164 @@ class Model(object):
         self.initial_state = act_model.initial_state
         self.save = save
         self.load = load
+        self.wait_saves = checkpointer.wait
+        if snapshot:
+            self.snapshot_model = snapshot_model
+            self.sync_snapshot = sync_snapshot
         tf.global_variables_initializer().run(session=sess) #pylint: disable=E1101
 
+class RolloutBuffer(object):
+    """
+    Arrays of one rollout, allocated once in the (nenvs*nsteps, ...) layout
+    that Model.train consumes: row env*nsteps + t holds step t of env env.
+    Runner.run writes every step in place, so no per-update copies are made.
+    """
+    def __init__(self, nenvs, nsteps, ob_shape, ob_dtype, ac_shape, ac_dtype):
+        self.nenvs = nenvs
+        self.nsteps = nsteps
+        nbatch = nenvs * nsteps
+        self.obs = np.zeros((nbatch,) + tuple(ob_shape), dtype=ob_dtype)
+        self.returns = np.zeros(nbatch, dtype=np.float32)
+        self.dones = np.zeros(nbatch, dtype=np.bool_)
+        self.actions = np.zeros((nbatch,) + tuple(ac_shape), dtype=ac_dtype)
+        self.values = np.zeros(nbatch, dtype=np.float32)
+        self.neglogpacs = np.zeros(nbatch, dtype=np.float32)
+        self.rewards = np.zeros(nbatch, dtype=np.float32)
+
+    def steps(self, arr):
+        """
+        (nsteps, nenvs, ...) view of arr, indexed like the rollout
+        """
+        return arr.reshape((self.nenvs, self.nsteps) + arr.shape[1:]).swapaxes(0, 1)
+
+    def add(self, t, obs, actions, values, neglogpacs, dones):
+        """
+        Store what was known before step t; its reward goes to self.rewards
+        """
+        for arr, value in ((self.obs, obs), (self.actions, actions), (self.values, values),
+                           (self.neglogpacs, neglogpacs), (self.dones, dones)):
+            self.steps(arr)[t] = value
+
+    def arrays(self):
+        # obs, returns, masks, actions, values, neglogpacs
+        return self.obs, self.returns, self.dones, self.actions, self.values, self.neglogpacs
+
 class Runner(AbstractEnvRunner):
 
     def __init__(self, *, env, model, nsteps, gamma, lam):
         super().__init__(env=env, model=model, nsteps=nsteps)
         self.lam = lam
         self.gamma = gamma
+        self.buffer = self.make_buffer()
 
-    def run(self):
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs = [],[],[],[],[],[]
+    def make_buffer(self):
+        ac_space = self.env.action_space
+        ac_dtype = np.int64 if ac_space.shape == () else ac_space.dtype
+        return RolloutBuffer(self.env.num_envs, self.nsteps, self.obs.shape[1:], self.obs.dtype,
+                             ac_space.shape, ac_dtype)
+
+    def run(self, buffer=None, stop=None):
+        """
+        Collect nsteps into buffer (by default self.buffer, which is
+        overwritten by the next call) and return its arrays; return None
+        instead, leaving a partial buffer, once the threading.Event stop is set
+        """
+        mb = self.buffer if buffer is None else buffer
         mb_states = self.states
         epinfos = []
-        for _ in range(self.nsteps):
+        for t in range(self.nsteps):
+            if stop is not None and stop.is_set():
+                return None
             actions, values, self.states, neglogpacs = self.model.step(self.obs, self.states, self.dones)
-            mb_obs.append(self.obs.copy())
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_neglogpacs.append(neglogpacs)
-            mb_dones.append(self.dones)
+            mb.add(t, self.obs, actions, values, neglogpacs, self.dones)
             self.obs[:], rewards, self.dones, infos = self.env.step(actions)
+            mb.steps(mb.rewards)[t] = rewards
             for info in infos:
                 maybeepinfo = info.get('episode')
                 if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_rewards.append(rewards)
-        #batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=self.obs.dtype)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32)
-        mb_actions = np.asarray(mb_actions)
-        mb_values = np.asarray(mb_values, dtype=np.float32)
-        mb_neglogpacs = np.asarray(mb_neglogpacs, dtype=np.float32)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool)
         last_values = self.model.value(self.obs, self.states, self.dones)
         #discount/bootstrap off value fn
-        mb_returns = np.zeros_like(mb_rewards)
-        mb_advs = np.zeros_like(mb_rewards)
-        lastgaelam = 0
-        for t in reversed(range(self.nsteps)):
-            if t == self.nsteps - 1:
-                nextnonterminal = 1.0 - self.dones
-                nextvalues = last_values
-            else:
-                nextnonterminal = 1.0 - mb_dones[t+1]
-                nextvalues = mb_values[t+1]
-            delta = mb_rewards[t] + self.gamma * nextvalues * nextnonterminal - mb_values[t]
-            mb_advs[t] = lastgaelam = delta + self.gamma * self.lam * nextnonterminal * lastgaelam
-        mb_returns = mb_advs + mb_values
-        return (*map(sf01, (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs)),
-            mb_states, epinfos)
+        _, returns = gae(mb.steps(mb.rewards), mb.steps(mb.values), mb.steps(mb.dones),
+                         last_values, self.dones, self.gamma, self.lam)
+        mb.steps(mb.returns)[:] = returns
+        return (*mb.arrays(), mb_states, epinfos)
 # obs, returns, masks, actions, values, neglogpacs, states = runner.run()
+
+class AsyncRunner(object):
+    """
+    Actor side of the actor/learner mode of learn: a background thread keeps
+    collecting rollouts with the snapshot policy of model, whose weights are
+    copied from the trained ones at the start of every rollout, while the
+    learner trains on the previous rollouts.
+
+    Rollouts wait in a queue of at most queue_size; the thread then blocks
+    until the learner releases a buffer. The policy lag of a rollout is the
+    number of train calls made between its snapshot and get(). The
+    VecNormalize statistics of env at the end of the rollout, which the
+    actor keeps updating, are copied by the thread into vec_normalize.
+    """
+    def __init__(self, *, env, model, nsteps, gamma, lam, queue_size=1):
+        self.model = model
+        self.runner = Runner(env=env, model=model.snapshot_model, nsteps=nsteps, gamma=gamma, lam=lam)
+        # One buffer being filled, queue_size waiting and one being trained on
+        self._free = queue.Queue()
+        self._free.put(self.runner.buffer)
+        for _ in range(queue_size + 1):
+            self._free.put(self.runner.make_buffer())
+        self._rollouts = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self.policy_lag = 0
+        self.vec_normalize = None
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def _collect(self):
+        try:
+            while not self._stop.is_set():
+                buffer = self._free.get()
+                if buffer is None:
+                    return
+                version = self.model.sync_snapshot()
+                rollout = self.runner.run(buffer, stop=self._stop)
+                if rollout is None:
+                    return
+                stats = vec_normalize_arrays(self.runner.env)
+                self._rollouts.put((version, buffer, rollout, stats))
+        except Exception as e: #pylint: disable=W0703
+            self._rollouts.put((None, None, e, None))
+
+    def get(self):
+        """
+        Wait for the next rollout and return its buffer and runner.run output;
+        release the buffer once done with the arrays
+        """
+        version, buffer, rollout, stats = self._rollouts.get()
+        if isinstance(rollout, Exception):
+            raise rollout
+        self.policy_lag = self.model.train_steps - version
+        self.vec_normalize = stats
+        return buffer, rollout
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+    def close(self, wait=True):
+        """
+        Stop the thread after its current env step, abandoning the rollout;
+        with wait=False, e.g. while an exception propagates, return without
+        waiting for that step
+        """
+        self._stop.set()
+        self._free.put(None)
+        if not wait:
+            return
+        while self._thread.is_alive():
+            try:
+                self._rollouts.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
 def sf01(arr):
     """
     swap and then flatten axes 0 and 1
@@ -148,7 +361,21 @@ def constfn(val):
 def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
             vf_coef=0.5,  max_grad_norm=0.5, gamma=0.99, lam=0.95,
             log_interval=10, nminibatches=4, noptepochs=4, cliprange=0.2,
-            save_interval=0, load_path=None):
+            save_interval=0, load_path=None, actor_learner=False, rollout_queue=1,
+            pipeline=True, keep_checkpoints=5):
+    """
+    actor_learner: collect rollouts in a background thread (see AsyncRunner)
+    while training, instead of alternating between the two; every update
+    then trains on a rollout of an older policy, whose lag is logged as
+    policy_lag in updates
+    rollout_queue: number of rollouts the actor may collect ahead
+    pipeline: feed every rollout to the graph once and let it shuffle and
+    slice the minibatches (see MinibatchPipeline); needs a policy taking
+    observ_placeholder, and pipeline=False for recurrent policies
+    keep_checkpoints: number of the last checkpoints kept in checkpoints/ of
+    the log dir, 0 keeps all; load_path may name a checkpoint of any run,
+    and learn resumes from the update saved with it
+    """
 
     if isinstance(lr, float): lr = constfn(lr)
     else: assert callable(lr)
@@ -164,77 +391,112 @@ def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
 
     make_model = lambda : Model(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs, nbatch_train=nbatch_train,
                     nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
-                    max_grad_norm=max_grad_norm)
+                    max_grad_norm=max_grad_norm, snapshot=actor_learner,
+                    pipeline=pipeline, keep_checkpoints=keep_checkpoints)
     if save_interval and logger.get_dir():
         import cloudpickle
         with open(osp.join(logger.get_dir(), 'make_model.pkl'), 'wb') as fh:
             fh.write(cloudpickle.dumps(make_model))
     model = make_model()
+    start = 0
     if load_path is not None:
-        model.load(load_path)
-    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+        start = model.load(load_path, env) or 0
+    if actor_learner:
+        runner = AsyncRunner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam,
+                             queue_size=rollout_queue)
+    else:
+        runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
 
     epinfobuf = deque(maxlen=100)
     tfirststart = time.time()
 
     nupdates = total_timesteps//nbatch
-    for update in range(1, nupdates+1):
-        assert nbatch % nminibatches == 0
-        nbatch_train = nbatch // nminibatches
-        tstart = time.time()
-        frac = 1.0 - (update - 1.0) / nupdates
-        lrnow = lr(frac)
-        cliprangenow = cliprange(frac)
-        obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
-        epinfobuf.extend(epinfos)
-        mblossvals = []
-        if states is None: # nonrecurrent version
-            inds = np.arange(nbatch)
-            for _ in range(noptepochs):
-                np.random.shuffle(inds)
-                for start in range(0, nbatch, nbatch_train):
-                    end = start + nbatch_train
-                    mbinds = inds[start:end]
-                    slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                    mblossvals.append(model.train(lrnow, cliprangenow, *slices))
-        else: # recurrent version
-            assert nenvs % nminibatches == 0
-            envsperbatch = nenvs // nminibatches
-            envinds = np.arange(nenvs)
-            flatinds = np.arange(nenvs * nsteps).reshape(nenvs, nsteps)
-            envsperbatch = nbatch_train // nsteps
-            for _ in range(noptepochs):
-                np.random.shuffle(envinds)
-                for start in range(0, nenvs, envsperbatch):
-                    end = start + envsperbatch
-                    mbenvinds = envinds[start:end]
-                    mbflatinds = flatinds[mbenvinds].ravel()
-                    slices = (arr[mbflatinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                    mbstates = states[mbenvinds]
-                    mblossvals.append(model.train(lrnow, cliprangenow, *slices, mbstates))
-
-        lossvals = np.mean(mblossvals, axis=0)
-        tnow = time.time()
-        fps = int(nbatch / (tnow - tstart))
-        if update % log_interval == 0 or update == 1:
-            ev = explained_variance(values, returns)
-            logger.logkv("serial_timesteps", update*nsteps)
-            logger.logkv("nupdates", update)
-            logger.logkv("total_timesteps", update*nbatch)
-            logger.logkv("fps", fps)
-            logger.logkv("explained_variance", float(ev))
-            logger.logkv('eprewmean', safemean([epinfo['r'] for epinfo in epinfobuf]))
-            logger.logkv('eplenmean', safemean([epinfo['l'] for epinfo in epinfobuf]))
-            logger.logkv('time_elapsed', tnow - tfirststart)
-            for (lossval, lossname) in zip(lossvals, model.loss_names):
-                logger.logkv(lossname, lossval)
-            logger.dumpkvs()
-        if save_interval and (update % save_interval == 0 or update == 1) and logger.get_dir():
-            checkdir = osp.join(logger.get_dir(), 'checkpoints')
-            os.makedirs(checkdir, exist_ok=True)
-            savepath = osp.join(checkdir, '%.5i'%update)
-            print('Saving to', savepath)
-            model.save(savepath)
+    try:
+        for update in range(start + 1, nupdates+1):
+            assert nbatch % nminibatches == 0
+            nbatch_train = nbatch // nminibatches
+            tstart = time.time()
+            frac = 1.0 - (update - 1.0) / nupdates
+            lrnow = lr(frac)
+            cliprangenow = cliprange(frac)
+            if actor_learner:
+                buffer, rollout = runner.get()
+                twait = time.time() - tstart
+            else:
+                rollout = runner.run()
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = rollout #pylint: disable=E0632
+            epinfobuf.extend(epinfos)
+            mblossvals = []
+            if pipeline:
+                assert states is None, 'recurrent policies need pipeline=False'
+                model.upload(noptepochs, obs, returns, masks, actions, values, neglogpacs)
+                for _ in range(noptepochs * nminibatches):
+                    mblossvals.append(model.train_next(lrnow, cliprangenow))
+            elif states is None: # nonrecurrent version
+                inds = np.arange(nbatch)
+                for _ in range(noptepochs):
+                    np.random.shuffle(inds)
+                    for start in range(0, nbatch, nbatch_train):
+                        end = start + nbatch_train
+                        mbinds = inds[start:end]
+                        slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
+                        mblossvals.append(model.train(lrnow, cliprangenow, *slices))
+            else: # recurrent version
+                assert nenvs % nminibatches == 0
+                envsperbatch = nenvs // nminibatches
+                envinds = np.arange(nenvs)
+                flatinds = np.arange(nenvs * nsteps).reshape(nenvs, nsteps)
+                envsperbatch = nbatch_train // nsteps
+                for _ in range(noptepochs):
+                    np.random.shuffle(envinds)
+                    for start in range(0, nenvs, envsperbatch):
+                        end = start + envsperbatch
+                        mbenvinds = envinds[start:end]
+                        mbflatinds = flatinds[mbenvinds].ravel()
+                        slices = (arr[mbflatinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
+                        mbstates = states[mbenvinds]
+                        mblossvals.append(model.train(lrnow, cliprangenow, *slices, mbstates))
+
+            lossvals = np.mean(mblossvals, axis=0)
+            tnow = time.time()
+            fps = int(nbatch / (tnow - tstart))
+            if update % log_interval == 0 or update == 1:
+                ev = explained_variance(values, returns)
+                logger.logkv("serial_timesteps", update*nsteps)
+                logger.logkv("nupdates", update)
+                logger.logkv("total_timesteps", update*nbatch)
+                logger.logkv("fps", fps)
+                logger.logkv("explained_variance", float(ev))
+                logger.logkv('eprewmean', safemean([epinfo['r'] for epinfo in epinfobuf]))
+                logger.logkv('eplenmean', safemean([epinfo['l'] for epinfo in epinfobuf]))
+                logger.logkv('time_elapsed', tnow - tfirststart)
+                if actor_learner:
+                    logger.logkv('policy_lag', runner.policy_lag / (noptepochs * nminibatches))
+                    logger.logkv('rollout_wait', twait)
+                for (lossval, lossname) in zip(lossvals, model.loss_names):
+                    logger.logkv(lossname, lossval)
+                logger.dumpkvs()
+            if save_interval and (update % save_interval == 0 or update == 1) and logger.get_dir():
+                checkdir = osp.join(logger.get_dir(), 'checkpoints')
+                os.makedirs(checkdir, exist_ok=True)
+                savepath = osp.join(checkdir, '%.5i.npz'%update)
+                print('Saving to', savepath)
+                # The actor thread updates the statistics of env while stepping
+                model.save(savepath, env, update,
+                           runner.vec_normalize if actor_learner else None)
+            if actor_learner:
+                runner.release(buffer)
+    except BaseException:
+        if actor_learner:
+            # The actor thread is a daemon, so do not wait out its env step
+            runner.close(wait=False)
+        raise
+    else:
+        if actor_learner:
+            runner.close()
+    finally:
+        # Also when learn raises, so that latest() finds the last checkpoint
+        model.wait_saves()
     env.close()
     return model
 
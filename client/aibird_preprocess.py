@@ -0,0 +1,53 @@
+"""uint8 screenshot preprocessing for the AIBird environments
+
+Every function takes and returns (height, width[, channels]) uint8 arrays, so
+observations stay 1 byte per pixel from the client to the TF feed; the
+policy scales them to [0, 1] itself (see aibird_policies.nature_cnn).
+
+Example:
+    env = aibird_env.AIBirdEnv(..., process_state=process_screenshot)
+"""
+import numpy as np
+
+SCORE_ROWS = 100    # Rows on top of the screenshot showing the score
+
+
+def crop(img, top=0, bottom=0, left=0, right=0):
+    """Return a view of `img` without the given number of border pixels."""
+    height, width = img.shape[:2]
+    return img[top:height - bottom, left:width - right]
+
+def downsample(img, factor, mode='area'):
+    """Shrink `img` by the integer `factor` along height and width.
+
+    mode 'area' averages every factor x factor block (rounded), 'stride' keeps
+    its top-left pixel. Rows and columns that do not fill a block are dropped.
+    The result never shares memory with `img`, which may be a reused buffer.
+    """
+    if factor == 1:
+        return img.copy()
+    height, width = img.shape[0] // factor * factor, img.shape[1] // factor * factor
+    if mode == 'stride':
+        return np.ascontiguousarray(img[:height:factor, :width:factor])
+    if mode != 'area':
+        raise ValueError('Unknown downsampling mode {}'.format(mode))
+    area = factor * factor
+    # Adding the factor^2 strided views is much faster than a reduction over
+    # reshaped block axes; uint16 holds the sum for factors up to 16
+    total = np.full(((height // factor, width // factor) + img.shape[2:]), area // 2,
+                    dtype=np.uint16 if area <= 256 else np.uint32)
+    for row in range(factor):
+        for col in range(factor):
+            total += img[row:height:factor, col:width:factor]
+    total //= area
+    return total.astype(np.uint8)
+
+def grayscale(img):
+    """Return the luma of an RGB image, (height, width, 1) uint8."""
+    weights = np.array([299, 587, 114], dtype=np.uint32)
+    luma = (img.astype(np.uint32) @ weights + 500) // 1000
+    return luma.astype(np.uint8)[..., None]
+
+def process_screenshot(img, factor=2, mode='area'):
+    """Crop away the score and the last row, then shrink by `factor`."""
+    return downsample(crop(img, SCORE_ROWS, 1), factor, mode)
@@ -0,0 +1,56 @@
+"""Exact-length reads from the AIBird server into reusable buffers
+
+Example:
+    reader = FramedReader(sock)
+    size = recv_screenshot_size(reader.read(LEN_SCREENSHOT))
+    data = reader.read(size, slot='payload')    # memoryview, valid until the next read
+"""
+import struct
+
+INT = struct.Struct('!i')
+
+
+class FramedReader:
+    """Reads fixed-length responses from a socket without intermediate copies.
+
+    Every slot owns one bytearray that is reused by the reads of that slot and
+    only reallocated when a larger response arrives, so memory use stays at the
+    largest response seen. A view returned by `read` or `buffer` is valid until
+    the next call for the same slot.
+
+    Attributes
+        socket (socket.socket): connected socket to read from
+        nbytes (int): number of bytes received so far
+    """
+    def __init__(self, sock):
+        self.socket = sock
+        self.nbytes = 0
+        self._pool = {}
+
+    def buffer(self, size, slot='header'):
+        """Return a writable memoryview of `size` bytes owned by `slot`."""
+        buf = self._pool.get(slot)
+        if buf is None or len(buf) < size:
+            capacity = size if buf is None else max(size, 2 * len(buf))
+            buf = self._pool[slot] = memoryview(bytearray(capacity))
+        return buf[:size]
+
+    def recv_into(self, view):
+        """Fill `view` from the socket, retrying on short reads."""
+        received = 0
+        size = len(view)
+        while received < size:
+            nbytes = self.socket.recv_into(view[received:])
+            if nbytes == 0:
+                raise ConnectionError('AIBird server closed the connection')
+            received += nbytes
+        self.nbytes += size
+        return view
+
+    def read(self, size, slot='header'):
+        """Receive exactly `size` bytes into the buffer of `slot`."""
+        return self.recv_into(self.buffer(size, slot))
+
+    def read_int(self):
+        """Receive one network order int."""
+        return INT.unpack(self.read(INT.size))[0]
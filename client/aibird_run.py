@@ -5,20 +5,25 @@ import os
 import sys
 from socket import timeout
 
+import numpy as np
 import tensorflow as tf
 
-# from skimage.color import rgb2grey
-from skimage.transform import rescale
-
 from baselines import bench, logger
 from baselines.common import set_global_seeds
-from baselines.ppo2 import ppo2
-from aibird_policies import CnnPolicy, CnnPolicyTest
+from aibird_policies import CnnPolicy
 
 import aibird_env
+import aibird_ppo2 as ppo2
+from aibird_checkpoint import latest
+from aibird_action_vec_env import ActionMapVecEnv
+from aibird_actions import QuantizedActions
 
 MAX_ACTION = [90, 2.5]
 MIN_ACTION = [-10, 0.1]
+# The server crops away unnecessary parts(the score part and the last row)
+# and halves the resolution before sending screenshots
+SCREENSHOT_ROI = (0, 100, 0, 379)
+SCREENSHOT_SCALE = 2
 
 def train(penv, num_timesteps, seed, load_path=None):
     """ Slight modification of train method in baselines.ppo2.run_mujoco """
@@ -36,8 +41,8 @@ def train(penv, num_timesteps, seed, load_path=None):
         return env
     set_global_seeds(seed)
     with tf.Session(config=config) as _:
-        env = DummyVecEnv([make_env])
-        env = VecNormalize(env)
+        env = ActionMapVecEnv(DummyVecEnv([make_env]), quantize)
+        env = VecNormalize(env, ob=False)  # Keep uint8 frames, the policy scales them
         ppo2.learn(policy=CnnPolicy, env=env, nsteps=1024, nminibatches=32,
                    lam=0.95, gamma=1, noptepochs=10, log_interval=1,
                    ent_coef=.01,
@@ -46,20 +51,8 @@ def train(penv, num_timesteps, seed, load_path=None):
                    total_timesteps=int(num_timesteps * 1.1),
                    load_path=load_path)
 
-def process_screensot(img):
-    """Crop away unnecessary parts(the score part)"""
-    cimg = img[100:-1, :, :]
-    return rescale(cimg, 0.5)
-
-def quantize(act):
-    """ 60 actions : 12 angle actions * 5 tap time actions """
-    nangle = (act % 12)
-    ntap = (act // 12) + 1
-    tangle = nangle / 12
-    ttap = ntap / 5
-    angle = tangle * MAX_ACTION[0] + (1 - tangle) * MIN_ACTION[0]
-    tap = ttap * MAX_ACTION[1] + (1 - ttap) * MIN_ACTION[1]
-    return angle, tap
+# 60 actions : 12 angle actions * 5 tap time actions
+quantize = QuantizedActions(MAX_ACTION, MIN_ACTION)
 
 # def killserver():
 #     """ Kill AIBirdServer """
@@ -78,18 +71,16 @@ def main():
     logger.configure('aibird_log_discrete')
     curr_dir_path = os.path.dirname(os.path.realpath(__file__))
     server_path = os.path.abspath(os.path.join(curr_dir_path, os.pardir, 'server'))
-    # find the newest checkpoint
     checkdir = os.path.join(logger.get_dir(), 'checkpoints')
-    load_path = None
-    if os.path.isdir(checkdir):
-        checkpoints = [os.path.join(checkdir, f) for f in os.listdir(checkdir)]
-        load_path = max(checkpoints, key=os.path.getctime)
-    print(load_path)
     while True:
+        # Resume from the newest checkpoint, also after a restart
+        load_path = latest(checkdir)
+        print(load_path)
         try:
             env = aibird_env.AIBirdEnv(
                 action_space=60, act_cont=False,
-                process_state=process_screensot, process_action=quantize)
+                process_action=np.asarray,
+                roi=SCREENSHOT_ROI, scale=SCREENSHOT_SCALE)
             env.startup(server_path, 1, 2000)
             train(env, int(1e6), 0, load_path)
         except timeout:
@@ -1,58 +1,112 @@
+import time
+from collections import deque
 from multiprocessing import Process, Pipe
+from multiprocessing.connection import wait
 from socket import timeout
 import numpy as np
 from baselines.common.vec_env import VecEnv, CloudpickleWrapper
 
 SUCCESS = 0
 FAILURE = -1
+LATENCY_WINDOW = 100    # Number of step latencies kept per env
+JOIN_TIMEOUT = 10       # Seconds to wait for a failed worker to exit on close
+MAX_RESPAWNS = 3        # Consecutive failures of an env before giving up on it
 
 
-def worker(remote, parent_remote, env_fn_wrapper):
+def worker(remote, parent_remote, env_fn_wrapper, attach=None):
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    env = None
+    shm = None
+    obs_slot = None
+
+    def pack(ob):
+        """ Write `ob` to the shared memory slot if there is one. """
+        if obs_slot is None:
+            return ob
+        obs_slot[...] = ob
+        return None
+
+    def attach_shared_memory(name, index, shape, dtype):
+        from multiprocessing.shared_memory import SharedMemory
+        block = SharedMemory(name=name)
+        return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)[index]
+
     try:
+        if attach is not None:
+            shm, obs_slot = attach_shared_memory(*attach)
+        env = env_fn_wrapper.x()
         while True:
             cmd, data = remote.recv()
             if cmd == 'step':
                 ob, reward, done, info = env.step(data)
                 if done:
                     ob = env.reset()
-                remote.send((SUCCESS, ob, reward, done, info))
+                remote.send((SUCCESS, pack(ob), reward, done, info))
             elif cmd == 'reset':
                 ob = env.reset()
-                remote.send((SUCCESS, ob))
+                remote.send((SUCCESS, pack(ob)))
             elif cmd == 'reset_task':
                 ob = env.reset_task()
-                remote.send((SUCCESS, ob))
+                remote.send((SUCCESS, pack(ob)))
             elif cmd == 'close':
                 remote.close()
                 break
             elif cmd == 'get_spaces':
                 remote.send((SUCCESS, env.observation_space, env.action_space))
+            elif cmd == 'attach':
+                shm, obs_slot = attach_shared_memory(*data)
+                remote.send((SUCCESS,))
             else:
                 raise NotImplementedError
     except timeout:
+        # Kill this env's chrome and server so that a replacement can reuse them
+        if env is not None and hasattr(env, 'terminate'):
+            env.terminate()
         remote.send((FAILURE,))
         remote.close()
+    finally:
+        if shm is not None:
+            obs_slot = None
+            shm.close()
 
 
 class SubprocVecEnv(VecEnv):
-    def __init__(self, env_fns, spaces=None):
+    def __init__(self, env_fns, spaces=None, shared_memory=False):
         """
         envs: list of gym environments to run in subprocesses
+        shared_memory: if True, workers write observations into one shared memory
+                       block instead of pickling them through the pipes, and
+                       step_wait/reset return a view of that block which the
+                       next call overwrites
+
+        A worker whose env times out is replaced by a fresh one built from the
+        same env_fn while the other envs keep stepping. Until the replacement
+        has reset, steps of that env return its last observation with reward 0
+        and info['respawning'] set, so that the learner can mask them; only the
+        first has done True. The first step after the replacement is ready
+        returns the reset observation with info['respawned'] set. An env that
+        fails MAX_RESPAWNS times in a row raises socket.timeout.
+
+        With shared memory, a replacement sends its reset observation through
+        the pipe and only gets its slot once the parent has copied it there,
+        so no worker writes the block while a returned view may be read.
         """
         self.waiting = False
         self.closed = False
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
-        self.ps = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-                   for (work_remote, remote, env_fn)
-                   in zip(self.work_remotes, self.remotes, env_fns)]
-        for p in self.ps:
-            p.daemon = True # if the main process crashes, we should not cause things to hang
-            p.start()
-        for remote in self.work_remotes:
-            remote.close()
+        self.env_fns = [CloudpickleWrapper(env_fn) for env_fn in env_fns]
+        self.remotes = [None] * nenvs
+        self.ps = [None] * nenvs
+        self.retired = []                 # Replaced workers, joined on close
+        self.failures = [0] * nenvs       # Consecutive failures of each env
+        self.attach = None
+        if shared_memory:
+            # Workers must share the resource tracker of this process: one
+            # of their own would unlink the block when its worker exits
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        for env_id in range(nenvs):
+            self._spawn(env_id)
 
         self.remotes[0].send(('get_spaces', None))
         result = self.remotes[0].recv()
@@ -60,45 +114,236 @@ class SubprocVecEnv(VecEnv):
             raise timeout
         _, observation_space, action_space = result
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        self.pending = [None] * nenvs     # Action in flight for each env
+        self.sent_at = [None] * nenvs
+        self.latencies = [deque(maxlen=LATENCY_WINDOW) for _ in range(nenvs)]
+        self.respawning = [False] * nenvs
+        self.done_reported = [False] * nenvs  # Whether a respawning env returned done
+        self.attached = [False] * nenvs       # Whether the worker writes to shared memory
+        self.respawns = 0
+        self.last_obs = [np.zeros(observation_space.shape, observation_space.dtype)
+                         for _ in range(nenvs)]
+        self.shm = None
+        self.obs_buf = None
+        if shared_memory:
+            self._attach_shared_memory()
+
+    def _spawn(self, env_id, attach=True):
+        """ Start the worker of `env_id`, attached to its shared memory slot if
+        there is one and `attach` is set.
+        """
+        remote, work_remote = Pipe()
+        attach_args = self._attach_args(env_id) if attach else None
+        p = Process(target=worker,
+                    args=(work_remote, remote, self.env_fns[env_id], attach_args))
+        p.daemon = True # if the main process crashes, we should not cause things to hang
+        p.start()
+        work_remote.close()
+        self.remotes[env_id] = remote
+        self.ps[env_id] = p
+
+    def _respawn(self, env_id):
+        """ Replace the failed worker of `env_id` and have the new one reset.
+
+        The replacement builds its env and resets in the background; its reset
+        result is picked up by a later step. The failed worker has already
+        terminated its env, so it is terminated rather than waited for.
+        """
+        self.failures[env_id] += 1
+        if self.failures[env_id] > MAX_RESPAWNS:
+            raise timeout('env {} failed {} times in a row'.format(env_id, self.failures[env_id]))
+        print('Respawning env', env_id, flush=True)
+        self.remotes[env_id].close()
+        if self.ps[env_id].is_alive():
+            self.ps[env_id].terminate()
+        self.retired.append(self.ps[env_id])
+        # Not attached until its reset observation is in the slot, see _ready
+        self._spawn(env_id, attach=False)
+        self.attached[env_id] = False
+        self.remotes[env_id].send(('reset', None))
+        if not self.respawning[env_id]:
+            self.done_reported[env_id] = False
+        self.respawning[env_id] = True
+        self.respawns += 1
+
+    def _ready(self, env_id, ob):
+        """ The worker of `env_id` answered a reset with `ob`: with shared
+        memory, copy `ob` to its slot and let the worker write there from now on.
+        """
+        self.respawning[env_id] = False
+        self.failures[env_id] = 0
+        if self.obs_buf is not None and not self.attached[env_id]:
+            self.obs_buf[env_id] = ob
+            self.remotes[env_id].send(('attach', self._attach_args(env_id)))
+            self._check_timeout([self._recv(env_id)])
+            self.attached[env_id] = True
+            return None
+        return ob
+
+    def _attach_args(self, env_id):
+        if self.attach is None:
+            return None
+        return (self.attach[0], env_id) + self.attach[1:]
+
+    def _attach_shared_memory(self):
+        """ Allocate the (nenvs, *obs_shape) block and hand a slot to every worker. """
+        from multiprocessing.shared_memory import SharedMemory
+        shape = (self.num_envs,) + self.observation_space.shape
+        dtype = np.dtype(self.observation_space.dtype)
+        self.shm = SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+        self.obs_buf = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.attach = (self.shm.name, shape, dtype.str)
+        for env_id, remote in enumerate(self.remotes):
+            remote.send(('attach', self._attach_args(env_id)))
+        self._check_timeout([remote.recv() for remote in self.remotes])
+        self.attached = [True] * self.num_envs
+
+    def _stack_obs(self, obs):
+        if self.obs_buf is not None:
+            return self.obs_buf
+        return np.stack(obs)
+
+    def _recv(self, env_id):
+        """ Receive from the worker of `env_id`, treating a dead worker as a failure. """
+        try:
+            return self.remotes[env_id].recv()
+        except (EOFError, ConnectionError):
+            return (FAILURE,)
 
     def step_async(self, actions):
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+        self.step_async_envs(range(self.num_envs), actions)
         self.waiting = True
 
     def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
+        results = [self._recv_step(env_id) for env_id in range(self.num_envs)]
         self.waiting = False
-        self._check_timeout(results)
         _, obs, rews, dones, infos = zip(*results)
-        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+        return self._stack_obs(obs), np.stack(rews), np.stack(dones), infos
+
+    def step_async_envs(self, env_ids, actions):
+        """ Send `actions` to the envs in `env_ids`, which must not have a step in flight.
+
+        The action of an env that is being respawned is dropped.
+        """
+        for env_id, action in zip(env_ids, actions):
+            assert self.pending[env_id] is None, 'env {} is still stepping'.format(env_id)
+            if not self.respawning[env_id]:
+                self.remotes[env_id].send(('step', action))
+            self.pending[env_id] = action
+            self.sent_at[env_id] = time.time()
+
+    def step_wait_any(self, k=1, max_wait=None):
+        """ Wait until at least `k` of the envs in flight have finished their step.
+
+        Envs that are slow to answer do not hold back the others: their results
+        are returned by a later call. Gives up after `max_wait` seconds, if given,
+        possibly with fewer than `k` results. Returns env_ids, obs, rews, dones,
+        infos and actions, each ordered like env_ids. The actions are the ones the
+        envs were stepped with.
+        """
+        waiting = {self.remotes[env_id]: env_id
+                   for env_id, action in enumerate(self.pending) if action is not None}
+        k = min(k, len(waiting))
+        deadline = None if max_wait is None else time.time() + max_wait
+        env_ids = []
+        while len(env_ids) < k:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            ready = wait(list(waiting), remaining)
+            if not ready:
+                break
+            env_ids.extend(waiting.pop(remote) for remote in ready)
+        env_ids.sort()
+        actions = [self.pending[env_id] for env_id in env_ids]
+        results = [self._recv_step(env_id) for env_id in env_ids]
+        if not results:
+            return np.array(env_ids, dtype=np.int64), None, None, None, (), []
+        _, obs, rews, dones, infos = zip(*results)
+        obs = np.stack(obs) if self.obs_buf is None else self.obs_buf[env_ids]
+        return (np.array(env_ids, dtype=np.int64), obs, np.stack(rews),
+                np.stack(dones), infos, actions)
+
+    def _recv_step(self, env_id):
+        if self.respawning[env_id] and not self.remotes[env_id].poll():
+            result = self._respawning_result(env_id)
+        else:
+            result = self._recv(env_id)
+            if result[0] != SUCCESS:
+                self._respawn(env_id)
+                result = self._respawning_result(env_id)
+            elif self.respawning[env_id]:
+                # The replacement has reset; its done was reported already
+                result = (SUCCESS, self._ready(env_id, result[1]), 0, False, {'respawned': True})
+            else:
+                self.failures[env_id] = 0
+        if self.obs_buf is None:
+            self.last_obs[env_id] = result[1]
+        self.latencies[env_id].append(time.time() - self.sent_at[env_id])
+        self.pending[env_id] = None
+        return result
+
+    def _respawning_result(self, env_id):
+        ob = None if self.obs_buf is not None else self.last_obs[env_id]
+        done = not self.done_reported[env_id]
+        self.done_reported[env_id] = True
+        return (SUCCESS, ob, 0, done, {'respawning': True})
+
+    @property
+    def queue_depth(self):
+        """ Number of envs with a step in flight """
+        return sum(action is not None for action in self.pending)
+
+    def stats(self):
+        """ Queue depth, respawn count and the recent step latencies of every env, in seconds """
+        means = [np.mean(lat) if lat else np.nan for lat in self.latencies]
+        maxes = [np.max(lat) if lat else np.nan for lat in self.latencies]
+        return {'queue_depth': self.queue_depth, 'respawns': self.respawns,
+                'latency_mean': means, 'latency_max': maxes}
 
     def reset(self):
-        for remote in self.remotes:
-            remote.send(('reset', None))
-        results = [remote.recv() for remote in self.remotes]
-        self._check_timeout(results)
-        _, obs = zip(*results)
-        return np.stack(obs)
+        return self._reset('reset')
 
     def reset_task(self):
-        for remote in self.remotes:
-            remote.send(('reset_task', None))
-        results = [remote.recv() for remote in self.remotes]
-        self._check_timeout(results)
-        _, obs = zip(*results)
-        return np.stack(obs)
+        return self._reset('reset_task')
+
+    def _reset(self, cmd):
+        """ Send `cmd` to every env, replacing and waiting for the workers that fail.
+
+        Raises socket.timeout if an env fails MAX_RESPAWNS times in a row.
+        """
+        for env_id, remote in enumerate(self.remotes):
+            if not self.respawning[env_id]:
+                remote.send((cmd, None))
+        obs = []
+        for env_id in range(self.num_envs):
+            result = self._recv(env_id)
+            while result[0] != SUCCESS:
+                self._respawn(env_id)
+                result = self._recv(env_id)
+            ob = self._ready(env_id, result[1])
+            if self.obs_buf is None:
+                self.last_obs[env_id] = ob
+            obs.append(ob)
+        return self._stack_obs(obs)
 
     def close(self):
         if self.closed:
             return
-        if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
+        for env_id, remote in enumerate(self.remotes):
+            if self.pending[env_id] is not None and not self.respawning[env_id]:
+                self._recv(env_id)
         for remote in self.remotes:
-            remote.send(('close', None))
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
         for p in self.ps:
             p.join()
+        for p in self.retired:
+            p.join(JOIN_TIMEOUT)
+        if self.shm is not None:
+            self.obs_buf = None
+            self.shm.close()
+            self.shm.unlink()
         self.closed = True
 
     def _check_timeout(self, results):
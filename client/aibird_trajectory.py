@@ -0,0 +1,271 @@
+"""Record AIBird trajectories to disk and replay them without a game
+
+The store is a directory of shards plus an `index.json`. Every row of a shard
+is one observation returned by the env, together with what produced it:
+
+    obs     -- the (processed) observation
+    action  -- the action of the step, zeros for a reset
+    reward  -- the reward of the step, 0 for a reset
+    done    -- whether the step ended the episode
+    reset   -- True if the row was returned by reset
+    state   -- GameState code after the step, -1 for a reset
+    level   -- level the step was played on
+
+Shards are compressed `.npz` files by default. With `compress=False` every
+field is a plain `.npy` file that the replay memory-maps.
+
+Usage:
+    env = RecordingEnv(aibird_env, 'trajectories/run1')
+    ...                                 # Train or play as usual
+    env.close()                         # Flushes the last shard
+
+    replay = ReplayEnv('trajectories/run1')
+    obs = replay.reset()
+    obs, reward, done, info = replay.step(None)     # info['action'] is the recorded action
+"""
+import json
+import os
+
+import numpy as np
+import gym
+
+INDEX = 'index.json'
+FIELDS = ('obs', 'action', 'reward', 'done', 'reset', 'state', 'level')
+
+
+def space_to_json(space):
+    if isinstance(space, gym.spaces.Discrete):
+        return {'type': 'discrete', 'n': int(space.n)}
+    return {'type': 'box', 'low': np.asarray(space.low).tolist(),
+            'high': np.asarray(space.high).tolist(), 'dtype': np.dtype(space.dtype).str}
+
+def space_from_json(spec):
+    if spec['type'] == 'discrete':
+        return gym.spaces.Discrete(spec['n'])
+    return gym.spaces.Box(low=np.asarray(spec['low']), high=np.asarray(spec['high']),
+                          dtype=np.dtype(spec['dtype']))
+
+
+class TrajectoryWriter:
+    """Appends rows to a trajectory store, one shard per `chunk_size` rows.
+
+    Rows are buffered in arrays allocated once, so recording costs one copy
+    of each observation until the shard is written. The action buffer takes
+    its shape and dtype from the first action added, as the actions an env
+    receives need not match its action_space (e.g. the (angle, tap) rows
+    inside an ActionMapVecEnv).
+    """
+    def __init__(self, path, observation_space, action_space, chunk_size=1024, compress=True):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.index = {'observation_space': space_to_json(observation_space),
+                      'action_space': space_to_json(action_space),
+                      'compress': compress, 'shards': []}
+        self._buffers = {
+            'obs': np.empty((chunk_size,) + observation_space.shape, observation_space.dtype),
+            'action': np.zeros((chunk_size,) + action_space.shape,
+                               np.int64 if action_space.shape == () else action_space.dtype),
+            'reward': np.empty(chunk_size, np.float32),
+            'done': np.empty(chunk_size, np.bool_),
+            'reset': np.empty(chunk_size, np.bool_),
+            'state': np.empty(chunk_size, np.int8),
+            'level': np.empty(chunk_size, np.int8),
+        }
+        self._size = 0
+        self._action_fixed = False
+
+    def add(self, obs, action=None, reward=0, done=False, reset=False, state=-1, level=0):
+        """Append one row. See the module docstring for the fields."""
+        if action is not None and not self._action_fixed:
+            # Only resets were added so far, whose actions are zeros
+            action = np.asarray(action)
+            self._buffers['action'] = np.zeros((self.chunk_size,) + action.shape, action.dtype)
+            self._action_fixed = True
+        row = dict(obs=obs, action=0 if action is None else action, reward=reward, done=done,
+                   reset=reset, state=state, level=level)
+        for field, buf in self._buffers.items():
+            buf[self._size] = row[field]
+        self._size += 1
+        if self._size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new shard and update the index."""
+        if self._size == 0:
+            return
+        name = 'shard_{:05d}'.format(len(self.index['shards']))
+        arrays = {field: buf[:self._size] for field, buf in self._buffers.items()}
+        if self.compress:
+            np.savez_compressed(os.path.join(self.path, name + '.npz'), **arrays)
+        else:
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+            for field, array in arrays.items():
+                np.save(os.path.join(self.path, name, field + '.npy'), array)
+        self.index['shards'].append({'name': name, 'size': self._size})
+        self._size = 0
+        with open(os.path.join(self.path, INDEX), 'w') as index:
+            json.dump(self.index, index)
+
+
+def load_shard(path, index, shard):
+    """Return a dict of the fields of `shard`, memory-mapped if uncompressed."""
+    if index['compress']:
+        with np.load(os.path.join(path, shard['name'] + '.npz')) as arrays:
+            return {field: arrays[field] for field in FIELDS}
+    return {field: np.load(os.path.join(path, shard['name'], field + '.npy'), mmap_mode='r')
+            for field in FIELDS}
+
+def read_trajectories(path):
+    """Return every field of the store at `path` concatenated over all shards,
+    e.g. for behavior cloning from `obs` and `action`.
+    """
+    with open(os.path.join(path, INDEX)) as index_file:
+        index = json.load(index_file)
+    shards = [load_shard(path, index, shard) for shard in index['shards']]
+    return {field: np.concatenate([shard[field] for shard in shards]) for field in FIELDS}
+
+
+class RecordingEnv(gym.Wrapper):
+    """Records every reset and step of an AIBirdEnv to a trajectory store.
+
+    Args
+        env -- a started AIBirdEnv, possibly wrapped
+        path -- directory of the store
+        chunk_size, compress -- see TrajectoryWriter
+    """
+    def __init__(self, env, path, chunk_size=1024, compress=True):
+        super().__init__(env)
+        self.writer = TrajectoryWriter(path, env.observation_space, env.action_space,
+                                       chunk_size, compress)
+
+    def _level(self):
+        return self.env.unwrapped.aibird_client.current_level
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self.writer.add(obs, reset=True, level=self._level())
+        return obs
+
+    def step(self, action):
+        level = self._level()
+        obs, reward, done, info = self.env.step(action)
+        self.writer.add(obs, action, reward, done, state=info.get('state', -1), level=level)
+        return obs, reward, done, info
+
+    def close(self):
+        self.writer.flush()
+        return self.env.close()
+
+
+class ReplayEnv(gym.Env):
+    """Plays back a trajectory store as an env, at memory speed.
+
+    The actions given to `step` are ignored; the recorded one is returned in
+    info['action']. After the last recorded row the replay starts over.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX)) as index_file:
+            self.index = json.load(index_file)
+        if not self.index['shards']:
+            raise ValueError('No trajectories in {}'.format(path))
+        self._nrows = sum(shard['size'] for shard in self.index['shards'])
+        self.observation_space = space_from_json(self.index['observation_space'])
+        self.action_space = space_from_json(self.index['action_space'])
+        self._shard_id = -1
+        self._shard = None
+        self._row = 0
+
+    def _next_row(self):
+        """Return the fields of the next row, loading the next shard if needed."""
+        if self._shard is None or self._row == self.index['shards'][self._shard_id]['size']:
+            self._shard_id = (self._shard_id + 1) % len(self.index['shards'])
+            self._shard = load_shard(self.path, self.index, self.index['shards'][self._shard_id])
+            self._row = 0
+        row = {field: self._shard[field][self._row] for field in FIELDS}
+        self._row += 1
+        return row
+
+    def reset(self):
+        """Skip to the next recorded reset and return its observation."""
+        for _ in range(self._nrows):
+            row = self._next_row()
+            if row['reset']:
+                return row['obs']
+        raise ValueError('No recorded reset in {}'.format(self.path))
+
+    def step(self, action):
+        row = self._next_row()
+        if row['reset']:
+            # The recording ended this episode without done, e.g. a crash
+            self._row -= 1
+            return row['obs'], 0.0, True, {'truncated': True}
+        info = {'action': row['action'], 'state': int(row['state']), 'level': int(row['level'])}
+        return row['obs'], float(row['reward']), bool(row['done']), info
+
+    def render(self, mode='human'):
+        return None
+
+
+class _CountingEnv(gym.Env):
+    """Env whose observations count the steps, for test_round_trip."""
+    def __init__(self):
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 3), dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(60)
+        self.aibird_client = type('Client', (), {'current_level': 1})()
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+        return np.full((4, 3), self.t, np.uint8)
+
+    def step(self, action):
+        self.t += 1
+        return np.full((4, 3), self.t, np.uint8), float(self.t), self.t == 3, {'state': 5}
+
+def test_round_trip():
+    import tempfile
+    for compress in [True, False]:
+        with tempfile.TemporaryDirectory() as path:
+            env = RecordingEnv(_CountingEnv(), path, chunk_size=4, compress=compress)
+            expected = []
+            for _ in range(2):
+                expected.append((env.reset(), 0.0, False))
+                done = False
+                while not done:
+                    # (angle, tap) rows, like the actions inside an ActionMapVecEnv
+                    ob, reward, done, _ = env.step(np.array([45.0, 1.5]))
+                    expected.append((ob, reward, done))
+            env.close()
+
+            store = read_trajectories(path)
+            assert len(store['obs']) == len(expected)
+            for (ob, reward, done), row_ob, row_reward, row_done in zip(
+                    expected, store['obs'], store['reward'], store['done']):
+                assert np.array_equal(ob, row_ob) and reward == row_reward and done == row_done
+            assert store['action'].shape == (8, 2)
+            assert np.array_equal(store['action'][~store['reset']], [[45.0, 1.5]] * 6)
+
+            replay = ReplayEnv(path)
+            for _ in range(2):
+                ob = replay.reset()
+                assert np.array_equal(ob, expected[0][0])
+                for exp_ob, exp_reward, exp_done in expected[1:4]:
+                    ob, reward, done, info = replay.step(None)
+                    assert np.array_equal(ob, exp_ob) and reward == exp_reward and done == exp_done
+                    assert info['state'] == 5 and info['level'] == 1
+
+            writer = TrajectoryWriter(path, env.observation_space, env.action_space, chunk_size=2)
+            writer.add(np.zeros((4, 3), np.uint8), 1)
+            writer.flush()
+            try:
+                ReplayEnv(path).reset()
+                assert False, 'reset of a store without resets returned'
+            except ValueError:
+                pass
+    print('ok trajectory')
+
+if __name__ == '__main__':
+    test_round_trip()
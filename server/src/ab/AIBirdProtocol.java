@@ -4,6 +4,8 @@ import java.awt.image.BufferedImage;
 import java.awt.Color;
 import java.awt.Point;
 import java.awt.Rectangle;
+import java.util.ArrayList;
+import java.util.Arrays;
 import java.util.Base64;
 import java.util.List;
 import java.util.concurrent.TimeUnit;
@@ -12,6 +14,7 @@ import ab.other.ActionRobot;
 import ab.other.Shot;
 import ab.utils.StateUtil;
 import ab.vision.ABObject;
+import ab.vision.ABType;
 import ab.vision.GameStateExtractor.GameState;
 import ab.vision.Vision;
 import ab.vision.VisionUtils;
@@ -19,6 +22,10 @@ import ab.vision.VisionUtils;
 public class AIBirdProtocol {
         private final byte DOSCREENSHOT = 11;
         private final byte STATE = 12;
+        private final byte DORAWSCREENSHOT = 14;
+        private final byte DODELTASCREENSHOT = 15;
+        private final byte CONFIGURESCREENSHOT = 16;
+        private final byte VISION = 17;
         private final byte MYSCORE = 23;
         private final byte CARTSHOOTSAFE = 31;
         private final byte CARTSHOOTFAST = 41;
@@ -26,9 +33,20 @@ public class AIBirdProtocol {
         private final byte POLARSHOOTFAST = 42;
         private final byte FULLZOOMOUT = 34;
         private final byte FULLZOOMIN = 35;
+        private final byte POLARSTEP = 37;
+        private final byte POLARSTEPDELTA = 38;
+        private final byte POLARSTEPVISION = 39;
         private final byte LOADLEVEL = 51;
         private final byte RESTARTLEVEL = 52;
         private final byte ISLEVELOVER = 60;
+        private final byte READY = 61;
+        private final int POLL_MIN_MS = 50;
+        private final int POLL_MAX_MS = 1000;
+        private final int POLL_TIMEOUT_MS = 15000;
+        private final int RAW_UINT8 = 0;
+        private final int RAW_CHANNELS = 3;
+        private final int COLOR_RGB = 0;
+        private final int COLOR_GRAY = 1;
         private final double X_OFFSET = 0.5;
         private final double Y_OFFSET = 0.65;
         private int score = 0;
@@ -37,6 +55,15 @@ public class AIBirdProtocol {
         private int curLevel = 1;
         private int actions = 0;
         private GameState currentState = null;
+        // Reduction applied to raw, delta and step screenshots of this client
+        private Rectangle roi = null;
+        private int scale = 1;
+        private int colorMode = COLOR_RGB;
+        // Last frame sent by a delta screenshot, the reference of the next one
+        private int[] deltaFrame = null;
+        private int deltaWidth = 0;
+        private int deltaHeight = 0;
+        private int deltaTile = 0;
         private final int[] numberOfBirds = {3, 5, 4, 4, 4, 4, 4, 4, 4, 5, 4, 4, 4, 4, 4, 5, 3, 5, 4, 5, 8};
         private final String eagleHash;
 
@@ -56,23 +83,35 @@ public class AIBirdProtocol {
                 int result = -1;
                 switch (mid) {
                         case DOSCREENSHOT:
+                        case DORAWSCREENSHOT:
                         case STATE:
                         case MYSCORE:
                         case FULLZOOMOUT:
                         case FULLZOOMIN:
                         case RESTARTLEVEL:
                         case ISLEVELOVER:
+                        case READY:
+                        case VISION:
                                 result = 0;
                                 break;
                         case LOADLEVEL:
+                        case DODELTASCREENSHOT:
                                 result = 1;
                                 break;
                         case CARTSHOOTSAFE:
                         case CARTSHOOTFAST:
                         case POLARSHOOTSAFE:
                         case POLARSHOOTFAST:
+                        case POLARSTEP:
+                        case POLARSTEPVISION:
                                 result = 3;
                                 break;
+                        case POLARSTEPDELTA:
+                                result = 4;
+                                break;
+                        case CONFIGURESCREENSHOT:
+                                result = 6;
+                                break;
                         default:
                                 assert false: "Unknown MID: " + mid;
                 }
@@ -83,6 +122,15 @@ public class AIBirdProtocol {
                 switch (mid) {
                         case DOSCREENSHOT:
                                 return doScreenShot();
+                        case DORAWSCREENSHOT:
+                                return doRawScreenShot();
+                        case DODELTASCREENSHOT:
+                                return doDeltaScreenShot(theInput[0]);
+                        case VISION:
+                                return doVision();
+                        case CONFIGURESCREENSHOT:
+                                return configureScreenShot(theInput[0], theInput[1], theInput[2],
+                                                           theInput[3], theInput[4], theInput[5]);
                         case STATE:
                                 return state();
                         case MYSCORE:
@@ -93,6 +141,8 @@ public class AIBirdProtocol {
                                 return fullZoomIn();
                         case RESTARTLEVEL:
                                 return restartLevel();
+                        case READY:
+                                return ready();
                         case LOADLEVEL:
                                 return loadLevel(theInput[0]);
                         case CARTSHOOTSAFE:
@@ -103,6 +153,11 @@ public class AIBirdProtocol {
                                 return polarShoot(true, theInput[0], theInput[1], theInput[2]);
                         case POLARSHOOTFAST:
                                 return polarShoot(false, theInput[0], theInput[1], theInput[2]);
+                        case POLARSTEP:
+                        case POLARSTEPVISION:
+                                return polarStep(mid, theInput[0], theInput[1], theInput[2], 0);
+                        case POLARSTEPDELTA:
+                                return polarStep(mid, theInput[0], theInput[1], theInput[2], theInput[3]);
                         default:
                                 assert false: "Unknown MID: " + mid + ")";
                                 return new byte[1];             // Never Used
@@ -116,7 +171,7 @@ public class AIBirdProtocol {
                 return bos.toByteArray();
         }
 
-        private byte[] doScreenShot() throws IOException {
+        private BufferedImage takeScreenShot() {
                 BufferedImage screenshot = null;
                 boolean checkedNotEagle = false;
                 while (!checkedNotEagle) {
@@ -130,6 +185,11 @@ public class AIBirdProtocol {
                                 checkedNotEagle = true;
                         }
                 }
+                return screenshot;
+        }
+
+        private byte[] doScreenShot() throws IOException {
+                BufferedImage screenshot = takeScreenShot();
                 ByteArrayOutputStream bos = new ByteArrayOutputStream();
                 DataOutputStream dos = new DataOutputStream(bos);
                 ByteArrayOutputStream ibos = new ByteArrayOutputStream();
@@ -140,6 +200,227 @@ public class AIBirdProtocol {
                 return bos.toByteArray();
         }
 
+        // Header (width, height, channels, dtype) followed by the row major RGB bytes.
+        private byte[] doRawScreenShot() throws IOException {
+                return encodeRaw(takeScreenShot());
+        }
+
+        private byte[] encodeRaw(BufferedImage image) throws IOException {
+                image = reduce(image);
+                int width = image.getWidth();
+                int height = image.getHeight();
+                int channels = channels();
+                int[] argb = image.getRGB(0, 0, width, height, null, 0, width);
+                byte[] pixels = new byte[argb.length * channels];
+                for (int i = 0, j = 0; i < argb.length; i++) {
+                        j = writePixel(pixels, j, argb[i]);
+                }
+                ByteArrayOutputStream bos = new ByteArrayOutputStream(16 + pixels.length);
+                DataOutputStream dos = new DataOutputStream(bos);
+                dos.writeInt(width);
+                dos.writeInt(height);
+                dos.writeInt(channels);
+                dos.writeInt(RAW_UINT8);
+                dos.write(pixels);
+                return bos.toByteArray();
+        }
+
+        private int channels() {
+                return colorMode == COLOR_GRAY ? 1 : RAW_CHANNELS;
+        }
+
+        // Write the channels of one pixel at pixels[j] and return the next index.
+        private int writePixel(byte[] pixels, int j, int argb) {
+                int red = (argb >> 16) & 0xff;
+                int green = (argb >> 8) & 0xff;
+                int blue = argb & 0xff;
+                if (colorMode == COLOR_GRAY) {
+                        pixels[j++] = (byte) ((299 * red + 587 * green + 114 * blue + 500) / 1000);
+                } else {
+                        pixels[j++] = (byte) red;
+                        pixels[j++] = (byte) green;
+                        pixels[j++] = (byte) blue;
+                }
+                return j;
+        }
+
+        // Register the region (width or height 0 extends it to the edge), the
+        // integer downscale factor and the color mode of the screenshots to come.
+        // Replies 0 and keeps the previous settings if they are invalid or would
+        // reduce the screenshots to an empty image.
+        private byte[] configureScreenShot(int left, int top, int width, int height,
+                                           int factor, int mode) throws IOException {
+                if (left < 0 || top < 0 || width < 0 || height < 0 || factor < 1
+                                || (mode != COLOR_RGB && mode != COLOR_GRAY)) {
+                        return writeInt(0);
+                }
+                // Reject a region that reduces to an empty image
+                BufferedImage screenshot = ActionRobot.doScreenShot();
+                Rectangle region = crop(new Rectangle(left, top, width, height),
+                                        screenshot.getWidth(), screenshot.getHeight());
+                if (region.width / factor == 0 || region.height / factor == 0) {
+                        return writeInt(0);
+                }
+                roi = new Rectangle(left, top, width, height);
+                scale = factor;
+                colorMode = mode;
+                deltaFrame = null;
+                return writeInt(1);
+        }
+
+        // Part of an imageWidth x imageHeight image inside `region`.
+        private Rectangle crop(Rectangle region, int imageWidth, int imageHeight) {
+                int left = Math.min(region.x, imageWidth - 1);
+                int top = Math.min(region.y, imageHeight - 1);
+                int width = imageWidth - left;
+                int height = imageHeight - top;
+                if (region.width > 0) width = Math.min(width, region.width);
+                if (region.height > 0) height = Math.min(height, region.height);
+                return new Rectangle(left, top, width, height);
+        }
+
+        // Crop to the registered region, then average every scale x scale block.
+        // Rows and columns that do not fill a block are dropped.
+        private BufferedImage reduce(BufferedImage image) {
+                if (roi != null) {
+                        Rectangle region = crop(roi, image.getWidth(), image.getHeight());
+                        image = image.getSubimage(region.x, region.y, region.width, region.height);
+                }
+                if (scale == 1) return image;
+                int width = image.getWidth() / scale;
+                int height = image.getHeight() / scale;
+                int[] argb = image.getRGB(0, 0, width * scale, height * scale, null, 0, width * scale);
+                BufferedImage reduced = new BufferedImage(width, height, BufferedImage.TYPE_INT_RGB);
+                int area = scale * scale;
+                for (int y = 0; y < height; y++) {
+                        for (int x = 0; x < width; x++) {
+                                int red = area / 2, green = area / 2, blue = area / 2;
+                                for (int dy = 0; dy < scale; dy++) {
+                                        int row = (y * scale + dy) * width * scale + x * scale;
+                                        for (int dx = 0; dx < scale; dx++) {
+                                                int pixel = argb[row + dx];
+                                                red += (pixel >> 16) & 0xff;
+                                                green += (pixel >> 8) & 0xff;
+                                                blue += pixel & 0xff;
+                                        }
+                                }
+                                reduced.setRGB(x, y, (red / area) << 16 | (green / area) << 8 | blue / area);
+                        }
+                }
+                return reduced;
+        }
+
+        private byte[] doDeltaScreenShot(int tile) throws IOException {
+                if (tile <= 0) {
+                        return rejectedDelta();
+                }
+                return encodeDelta(takeScreenShot(), tile);
+        }
+
+        // Delta header with every field 0 and no tiles, the reply to a tile size
+        // that is not positive.
+        private byte[] rejectedDelta() {
+                return new byte[24];
+        }
+
+        // Header (width, height, channels, dtype, tile size, number of tiles), the
+        // row major indices of the tiles that changed since the last delta
+        // screenshot sent to this client, then the RGB bytes of each of them.
+        // Tiles are tile x tile pixels, zero padded past the frame edges. Every
+        // tile is sent when there is no reference frame of the same size and tile.
+        private byte[] encodeDelta(BufferedImage image, int tile) throws IOException {
+                assert tile > 0: "Tile size must be positive: " + tile;
+                image = reduce(image);
+                int channels = channels();
+                int width = image.getWidth();
+                int height = image.getHeight();
+                int[] argb = image.getRGB(0, 0, width, height, null, 0, width);
+                boolean full = deltaFrame == null || deltaWidth != width
+                        || deltaHeight != height || deltaTile != tile;
+                int tilesX = (width + tile - 1) / tile;
+                int tilesY = (height + tile - 1) / tile;
+                List<Integer> changed = new ArrayList<Integer>();
+                for (int ty = 0; ty < tilesY; ty++) {
+                        for (int tx = 0; tx < tilesX; tx++) {
+                                if (full || tileChanged(argb, width, height, tile, tx, ty)) {
+                                        changed.add(ty * tilesX + tx);
+                                }
+                        }
+                }
+                ByteArrayOutputStream bos = new ByteArrayOutputStream(
+                        24 + changed.size() * (4 + tile * tile * channels));
+                DataOutputStream dos = new DataOutputStream(bos);
+                dos.writeInt(width);
+                dos.writeInt(height);
+                dos.writeInt(channels);
+                dos.writeInt(RAW_UINT8);
+                dos.writeInt(tile);
+                dos.writeInt(changed.size());
+                for (int index : changed) {
+                        dos.writeInt(index);
+                }
+                byte[] pixels = new byte[tile * tile * channels];
+                for (int index : changed) {
+                        int x0 = (index % tilesX) * tile;
+                        int y0 = (index / tilesX) * tile;
+                        Arrays.fill(pixels, (byte) 0);
+                        for (int y = y0; y < Math.min(y0 + tile, height); y++) {
+                                int j = (y - y0) * tile * channels;
+                                for (int x = x0; x < Math.min(x0 + tile, width); x++) {
+                                        j = writePixel(pixels, j, argb[y * width + x]);
+                                }
+                        }
+                        dos.write(pixels);
+                }
+                deltaFrame = argb;
+                deltaWidth = width;
+                deltaHeight = height;
+                deltaTile = tile;
+                return bos.toByteArray();
+        }
+
+        private boolean tileChanged(int[] argb, int width, int height, int tile, int tx, int ty) {
+                for (int y = ty * tile; y < Math.min((ty + 1) * tile, height); y++) {
+                        for (int x = tx * tile; x < Math.min((tx + 1) * tile, width); x++) {
+                                if (argb[y * width + x] != deltaFrame[y * width + x]) return true;
+                        }
+                }
+                return false;
+        }
+
+        private byte[] doVision() throws IOException {
+                return encodeVision(takeScreenShot());
+        }
+
+        // Number of objects followed by (type id, shape, x, y, width, height) of
+        // each object found by Vision in the full screenshot: pigs, birds,
+        // blocks, TNTs, hills and the sling.
+        private byte[] encodeVision(BufferedImage image) throws IOException {
+                Vision vision = new Vision(image);
+                List<ABObject> objects = new ArrayList<ABObject>();
+                objects.addAll(vision.findPigsMBR());
+                objects.addAll(vision.findBirdsMBR());
+                objects.addAll(vision.findBlocksMBR());
+                objects.addAll(vision.findTNTs());
+                objects.addAll(vision.findHills());
+                Rectangle sling = vision.findSling();
+                if (sling != null) {
+                        objects.add(new ABObject(sling, ABType.Sling));
+                }
+                ByteArrayOutputStream bos = new ByteArrayOutputStream(4 + objects.size() * 24);
+                DataOutputStream dos = new DataOutputStream(bos);
+                dos.writeInt(objects.size());
+                for (ABObject object : objects) {
+                        dos.writeInt(object.type.id);
+                        dos.writeInt(object.shape.ordinal());
+                        dos.writeInt(object.x);
+                        dos.writeInt(object.y);
+                        dos.writeInt(object.width);
+                        dos.writeInt(object.height);
+                }
+                return bos.toByteArray();
+        }
+
         private byte[] state() throws IOException {
                 if (currentState == null) {
                         return writeInt(-1);
@@ -169,15 +450,26 @@ public class AIBirdProtocol {
                 return writeInt(1);
         }
 
+        // Only answered once the browser is connected to the proxy, since the
+        // constructor waits for it. Replies with the code of the current state.
+        private byte[] ready() throws IOException {
+                currentState = aRobot.getState();
+                return writeInt(currentState.getCode());
+        }
+
+        // Poll with exponential backoff so that fast transitions return quickly.
         private void waitUntilState(GameState desired) {
-                for (int i = 0; i < 50; i++) {
+                long deadline = System.currentTimeMillis() + POLL_TIMEOUT_MS;
+                int delay = POLL_MIN_MS;
+                while (System.currentTimeMillis() < deadline) {
                         try {
-                                TimeUnit.MILLISECONDS.sleep(300);
+                                TimeUnit.MILLISECONDS.sleep(delay);
                         } catch(InterruptedException e){
                                 e.printStackTrace();
                         }
                         currentState = aRobot.getState();
                         if (currentState == desired) return;
+                        delay = Math.min(delay * 2, POLL_MAX_MS);
                 }
         }
 
@@ -216,7 +508,7 @@ public class AIBirdProtocol {
                 }
         }
         
-        private byte[] polarShoot(boolean isSafe, int r_int, int theta_int, int tap_time) throws IOException {
+        private void shootPolar(int r_int, int theta_int, int tap_time) {
                 double r = (double)r_int;
                 double theta = Math.toRadians(((double) theta_int) / 100.0);
                 int dx = Math.toIntExact(Math.round(r * Math.cos(theta) * -1));
@@ -228,6 +520,10 @@ public class AIBirdProtocol {
                 }
                 Shot shot = new Shot(sling.x, sling.y, dx, dy, 0, tap_time);
                 aRobot.cFastshoot(shot);
+        }
+
+        private byte[] polarShoot(boolean isSafe, int r_int, int theta_int, int tap_time) throws IOException {
+                shootPolar(r_int, theta_int, tap_time);
                 if (!isSafe) return writeInt(1);
                 try {
                         scoreCheck();
@@ -236,6 +532,49 @@ public class AIBirdProtocol {
                 }
         }
 
+        // Zoom out, shoot and reply with the score delta, the state code, the number
+        // of birds left and an observation in one message: a raw screenshot for
+        // POLARSTEP, a delta screenshot with tiles of size `tile` for
+        // POLARSTEPDELTA and the detected objects for POLARSTEPVISION.
+        // POLARSTEPDELTA with a tile size that is not positive does not shoot and
+        // replies a score delta of 0 and an empty delta header (see rejectedDelta).
+        private byte[] polarStep(byte mid, int r_int, int theta_int, int tap_time, int tile) throws IOException {
+                if (mid == POLARSTEPDELTA && tile <= 0) {
+                        GameState state = currentState == null ? GameState.UNKNOWN : currentState;
+                        ByteArrayOutputStream bos = new ByteArrayOutputStream();
+                        DataOutputStream dos = new DataOutputStream(bos);
+                        dos.writeInt(0);
+                        dos.writeInt(state.getCode());
+                        dos.writeInt(Math.max(0, numberOfBirds[curLevel - 1] - actions));
+                        dos.write(rejectedDelta());
+                        return bos.toByteArray();
+                }
+                ActionRobot.fullyZoomOut();
+                int initialScore = score;
+                shootPolar(r_int, theta_int, tap_time);
+                try {
+                        scoreCheck();
+                } catch (InterruptedException e) {
+                        e.printStackTrace();
+                }
+                GameState state = currentState == null ? GameState.UNKNOWN : currentState;
+                int birds = Math.max(0, numberOfBirds[curLevel - 1] - actions);
+                ByteArrayOutputStream bos = new ByteArrayOutputStream();
+                DataOutputStream dos = new DataOutputStream(bos);
+                dos.writeInt(score - initialScore);
+                dos.writeInt(state.getCode());
+                dos.writeInt(birds);
+                BufferedImage screenshot = takeScreenShot();
+                if (mid == POLARSTEPDELTA) {
+                        dos.write(encodeDelta(screenshot, tile));
+                } else if (mid == POLARSTEPVISION) {
+                        dos.write(encodeVision(screenshot));
+                } else {
+                        dos.write(encodeRaw(screenshot));
+                }
+                return bos.toByteArray();
+        }
+
         private Vision getVision() {
                 // capture Image
                 BufferedImage screenshot = ActionRobot.doScreenShot();
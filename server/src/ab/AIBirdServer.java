@@ -39,6 +39,8 @@ public class AIBirdServer {
                                 OutputStream out = clientSocket.getOutputStream();
                                 DataInputStream in = new DataInputStream(clientSocket.getInputStream());
                         ) {
+                                // Pipelined requests get one small reply each
+                                clientSocket.setTcpNoDelay(true);
                                 AIBirdProtocol abp = new AIBirdProtocol();
                                 while (true) {
                                         byte mid = in.readByte();